@@ -0,0 +1,233 @@
+"""Measures the Sheets API calls each command makes, using a fake Sheets service.
+
+Usage:
+  python bench.py           # Fails if any command goes over its budget.
+  python bench.py --record  # Saves the current numbers as the new budgets.
+
+Each command runs with a cold cache against sheets seeded with `--rows`
+rows, and the list message refreshes it schedules are included. The call
+count and response size are checked against bench_budget.json; wall time
+is only reported since it depends on the machine.
+"""
+
+
+import argparse
+import asyncio
+import discord
+import json
+import logging
+import sys
+import time
+
+
+from expiry import ExpiryQueue
+from fake_sheets import FakeSheetsService
+from sheets_orm import SheetsWrapper
+from user_commands import CallersCog, ListMessages, RequestsCog, UserCommandsCog
+
+
+budget_path = "bench_budget.json"
+# Response sizes vary a little with the dates written, so allow some slack.
+bytes_tolerance = 1.05
+target_id = 1
+
+
+class FakeMember(discord.Member):
+  """A member which records nothing and needs no connection state."""
+  def __init__(self, id: int):
+    self._id = id
+
+  @property
+  def id(self):
+    return self._id
+
+  @property
+  def mention(self):
+    return f"<@{self._id}>"
+
+  @property
+  def voice(self):
+    return None
+
+  def __str__(self):
+    return f"user{self._id}"
+
+  async def add_roles(self, *roles):
+    pass
+
+  async def remove_roles(self, *roles):
+    pass
+
+  async def send(self, *args, **kwargs):
+    pass
+
+
+class FakeGuild:
+  def get_member(self, user_id: int):
+    return FakeMember(user_id)
+
+
+class FakeMessage:
+  id = 1
+
+  async def edit(self, **kwargs):
+    pass
+
+
+class FakeConfig:
+  async def requests_message(self, fetch: bool=False):
+    return FakeMessage()
+
+  async def callers_message(self, fetch: bool=False):
+    return FakeMessage()
+
+  async def requests_role(self):
+    return object()
+
+  async def callers_role(self):
+    return object()
+
+  def requests_timeout(self) -> int:
+    return 7
+
+  def refresh_window(self) -> float:
+    return 0
+
+
+class FakeResponse:
+  async def defer(self, **kwargs):
+    pass
+
+  async def send_message(self, *args, **kwargs):
+    pass
+
+
+class FakeFollowup:
+  async def send(self, *args, **kwargs):
+    pass
+
+
+class FakeInteraction:
+  def __init__(self, user: FakeMember):
+    self.user = user
+    self.response = FakeResponse()
+    self.followup = FakeFollowup()
+
+
+def seed(rows: int, target_sheets: list[str]) -> dict[str, list[list]]:
+  date = "2024-01-01T00:00:00"
+  ids = range(1000, 1000 + rows)
+  sheets = {
+      "Requests": [["ID", "Name", "Date"]] + [[i, f"user{i}", date] for i in ids],
+      "New Callers": [["ID", "Name", "European", "Date"]] + [[i, f"user{i}", False, date] for i in ids],
+      "Repeat Callers": [["ID", "Name", "European", "Date"]] + [[i, f"user{i}", False, date] for i in ids],
+      "Caller History": [["ID", "Name", "Date"]] + [[i, f"user{i}", date] for i in ids],
+      "Denied Requests": [["ID", "Name", "Reason", "Date"]],
+      }
+  for sheet in target_sheets:
+    row = [target_id, f"user{target_id}"] + sheets[sheet][1][2:]
+    sheets[sheet].append(row)
+  return sheets
+
+
+# (name, cog, command, args, sheets the target user starts on)
+commands = [
+    ("screenme", UserCommandsCog, "screenme", [], []),
+    ("requests add", RequestsCog, "add", [FakeMember(target_id)], []),
+    ("requests approve", RequestsCog, "approve", [FakeMember(target_id)], ["Requests"]),
+    ("requests deny", RequestsCog, "deny", [FakeMember(target_id), "Bench"], ["Requests"]),
+    ("requests remove", RequestsCog, "remove", [FakeMember(target_id)], ["Requests"]),
+    ("requests refresh", RequestsCog, "refresh", [], []),
+    ("callers add", CallersCog, "add", [FakeMember(target_id)], []),
+    ("callers remove", CallersCog, "remove", [FakeMember(target_id)], ["New Callers"]),
+    ("callers chronicle", CallersCog, "chronicle", [FakeMember(target_id)], []),
+    ("callers refresh", CallersCog, "refresh", [], []),
+    ]
+
+
+def make_cog(cog_class, sheets_wrapper, list_messages):
+  config, guild = FakeConfig(), FakeGuild()
+  if cog_class is UserCommandsCog:
+    return UserCommandsCog(sheets_wrapper, config, guild, list_messages, ExpiryQueue())
+  if cog_class is RequestsCog:
+    return RequestsCog(sheets_wrapper, config, guild, list_messages, ExpiryQueue(), None)
+  return CallersCog(sheets_wrapper, config, guild, list_messages)
+
+
+async def run(name: str, cog_class, command: str, args: list, target_sheets: list[str], rows: int) -> dict:
+  service = FakeSheetsService(seed(rows, target_sheets))
+  sheets_wrapper = SheetsWrapper(None, "bench", cache=True, service=service, append_only=["Caller History"])
+  list_messages = ListMessages(sheets_wrapper, FakeConfig(), FakeGuild())
+  cog = make_cog(cog_class, sheets_wrapper, list_messages)
+
+  start = time.perf_counter()
+  await getattr(cog_class, command).callback(cog, FakeInteraction(FakeMember(target_id)), *args)
+  for scheduler in (list_messages.requests, list_messages.callers):
+    if scheduler.task:
+      await scheduler.task
+  seconds = time.perf_counter() - start
+
+  return {
+      "calls": len(service.calls),
+      "response_bytes": sum(call.response_bytes for call in service.calls),
+      "request_bytes": sum(call.request_bytes for call in service.calls),
+      "seconds": seconds,
+      "methods": [call.method for call in service.calls],
+      }
+
+
+def over_budget(result: dict, budget: dict) -> list[str]:
+  problems = []
+  if result["calls"] > budget["calls"]:
+    problems.append(f"{result['calls']} calls > {budget['calls']}")
+  if result["response_bytes"] > budget["response_bytes"] * bytes_tolerance:
+    problems.append(f"{result['response_bytes']} response bytes > {budget['response_bytes']}")
+  return problems
+
+
+async def main():
+  parser = argparse.ArgumentParser(description="Checks the Sheets API calls made by each command.")
+  parser.add_argument("--record", action="store_true", help="Save the results as the new budgets.")
+  parser.add_argument("--rows", type=int, help="The number of rows in each sheet. Defaults to the budget's.")
+  args = parser.parse_args()
+
+  try:
+    with open(budget_path) as budget_file:
+      budgets = json.load(budget_file)
+  except FileNotFoundError:
+    budgets = {"rows": 500, "commands": {}}
+  rows = args.rows or budgets["rows"]
+  if not args.record and rows != budgets["rows"]:
+    print(f"Budgets were recorded with {budgets['rows']} rows, so only --record makes sense with {rows}.")
+    sys.exit(2)
+
+  failed = False
+  results = {}
+  for name, cog_class, command, command_args, target_sheets in commands:
+    result = await run(name, cog_class, command, command_args, target_sheets, rows)
+    results[name] = result
+    status = ""
+    budget = budgets["commands"].get(name)
+    if not args.record and budget:
+      problems = over_budget(result, budget)
+      status = f"OVER BUDGET: {', '.join(problems)} ({', '.join(result['methods'])})" if problems else "ok"
+      failed |= bool(problems)
+    print(
+        f"{name:20} {result['calls']:3} calls {result['response_bytes']:9} B in "
+        f"{result['request_bytes']:6} B out {result['seconds'] * 1000:8.1f} ms  {status}")
+
+  if args.record:
+    budgets = {"rows": rows, "commands": {
+        name: {"calls": result["calls"], "response_bytes": result["response_bytes"]}
+        for name, result in results.items()}}
+    with open(budget_path, "w") as budget_file:
+      json.dump(budgets, budget_file, indent=2)
+      budget_file.write("\n")
+    print(f"Saved budgets to {budget_path}.")
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.WARNING)
+  asyncio.run(main())
@@ -3,22 +3,31 @@ import asyncio
 import discord
 import logging
 import sys
+import time
 import traceback
+import tracing
 
 
 from discord import app_commands
 from discord.ext import commands
 from global_config import GUILD_ID, SPREADSHEET_ID, SHEETS_SCOPES, DEV_ID, DISCORD_TOKEN
 from google.oauth2.service_account import Credentials
+from typing import Optional
 
 
 from config import ConfigCog, ConfigWrapper
-from sheets_orm import SheetsWrapper
+from expiry import ExpiryQueue
+from sheets_orm import SheetsWrapper, StorageBackend
+from sqlite_orm import SqliteBackend
+from stats import StatsCog, record_command
 from sync import SyncCog
-from user_commands import RequestsCog, CallersCog, UserCommandsCog
+from user_commands import ListMessages, RequestsCog, CallersCog, UserCommandsCog
+from watcher import SheetWatcherCog
 
 
 logger = logging.getLogger(__name__)
+# The sheets read by the list messages and the first commands after startup.
+warm_sheets = ["Requests", "New Callers", "Repeat Callers", "Caller History"]
 
 
 class LoaderCog(commands.Cog):
@@ -26,13 +35,20 @@ class LoaderCog(commands.Cog):
   A cog which loads all of the actual command cogs.
 
   LoaderCog will wait for the bot to connect to the Discord gateway so that
-  the other cogs can make API calls in their `cog_load()` methods.
+  the other cogs can make API calls in their `cog_load()` methods. Sheets
+  can be warmed up meanwhile by passing the `warm_up` task, and the time
+  from `started` to being ready and to the first command is logged.
   """
-  def __init__(self, bot: commands.Bot, sheets_wrapper: SheetsWrapper, config_path: str, schema_path: str):
+  def __init__(self, bot: commands.Bot, sheets_wrapper: StorageBackend, config_path: str, schema_path: str,
+      metrics_path: Optional[str]=None, warm_up: Optional[asyncio.Future]=None, started: Optional[float]=None):
     self.bot = bot
     self.sheets_wrapper = sheets_wrapper
     self.config_path = config_path
     self.schema_path = schema_path
+    self.metrics_path = metrics_path
+    self.warm_up = warm_up
+    self.started = started or time.perf_counter()
+    self.first_command_done = False
 
   async def cog_load(self):
     self.setup_task = asyncio.create_task(self.initial_setup())
@@ -43,6 +59,9 @@ class LoaderCog(commands.Cog):
     # TODO: Catch errors from the Sheets threads.
     # TODO: Add better separation between stacktraces within the logging.
     if interaction and isinstance(interaction.command, app_commands.Command):
+      record_command(interaction, error)
+      tracing.end_interaction(interaction, error)
+      self.log_first_command(interaction)
       content = f"Error running `/{interaction.command.qualified_name}`:\n```py\n{''.join(traceback.format_exception(error))}```"
     else:
       content = f"Error:\n```py\n{''.join(traceback.format_exception(error))}```"
@@ -64,6 +83,20 @@ class LoaderCog(commands.Cog):
     else:
       await interaction.followup.send(content=content)
 
+  @commands.Cog.listener()
+  async def on_app_command_completion(self, interaction: discord.Interaction, command):
+    tracing.end_interaction(interaction)
+    self.log_first_command(interaction)
+
+  def log_first_command(self, interaction: discord.Interaction):
+    if self.first_command_done:
+      return
+    self.first_command_done = True
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    logger.info(
+        f"First command /{interaction.command.qualified_name} answered in {latency:.2f}s, "
+        f"{time.perf_counter() - self.started:.1f}s after startup.")
+
   async def initial_setup(self):
     """Waits for the bot to connect before loading the rest of the cogs."""
     try:
@@ -71,6 +104,7 @@ class LoaderCog(commands.Cog):
       await self.bot.wait_until_ready()
       logger.info("Bot ready, performing initial setup...")
       self.bot.tree.on_error = self.handle_command_error
+      self.bot.tree.interaction_check = tracing.begin_interaction
 
       guild = self.bot.get_guild(GUILD_ID)
       if not guild:
@@ -84,19 +118,30 @@ class LoaderCog(commands.Cog):
         logging.warn(f"Unable to find dev with id {DEV_ID}")
 
       await self.bot.add_cog(SyncCog(guild, self.bot.tree))
+      await self.bot.add_cog(StatsCog(self.metrics_path))
       config_wrapper = ConfigWrapper(self.config_path, self.schema_path, guild)
-      await self.bot.add_cog(UserCommandsCog(self.sheets_wrapper, config_wrapper, guild))
+      list_messages = ListMessages(self.sheets_wrapper, config_wrapper, guild)
+      request_expiry = ExpiryQueue()
+      await self.bot.add_cog(UserCommandsCog(self.sheets_wrapper, config_wrapper, guild, list_messages, request_expiry))
       await self.bot.add_cog(ConfigCog(config_wrapper))
-      await self.bot.add_cog(RequestsCog(self.sheets_wrapper, config_wrapper, guild, dev))
-      await self.bot.add_cog(CallersCog(self.sheets_wrapper, config_wrapper, guild))
-
-      logging.info(f"Setup complete. Running in {guild} as {self.bot.user}!")
+      await self.bot.add_cog(RequestsCog(self.sheets_wrapper, config_wrapper, guild, list_messages, request_expiry, dev))
+      await self.bot.add_cog(CallersCog(self.sheets_wrapper, config_wrapper, guild, list_messages))
+      await self.bot.add_cog(SheetWatcherCog(self.sheets_wrapper, list_messages))
+
+      if self.warm_up:
+        try:
+          await self.warm_up
+        except Exception as err:
+          logger.warning("Unable to warm up Sheets, reading them on first use instead.", exc_info=err)
+      logging.info(
+          f"Setup complete in {time.perf_counter() - self.started:.1f}s. Running in {guild} as {self.bot.user}!")
     except Exception as err:
       logging.error("Error in initial setup. Shutting down...", exc_info=err)
       await self.bot.close()
 
 
 async def main():
+  started = time.perf_counter()
   parser = argparse.ArgumentParser()
   parser.add_argument(
       "--config", default="dev_config.json", help="The path to the JSON config for the bot.")
@@ -104,22 +149,47 @@ async def main():
       "--schema", default="schema.json", help="The path to the JSON schema for the bot config.")
   parser.add_argument(
       "--creds", default="creds.json", help="The path to the JSON service account key for Google Sheets.")
+  parser.add_argument(
+      "--journal", help="The path to a local journal for write-behind of appends and updates to Google Sheets.")
+  parser.add_argument(
+      "--db", help="The path to a SQLite database to store the lists in, mirroring them to Google Sheets.")
+  parser.add_argument(
+      "--metrics", help="The path to write metrics to in the Prometheus text format, e.g. for node_exporter.")
+  parser.add_argument(
+      "--snapshot",
+      help="The path to save the cached sheets to, so a restart can serve them before rereading. Unused with --db.")
+  parser.add_argument(
+      "--trace-log", help="Enables tracing and appends interactions slower than 3 seconds to this JSON lines file.")
   args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  if args.trace_log:
+    tracing.enable(args.trace_log)
 
   sheets_creds = Credentials.from_service_account_file(
     args.creds, scopes=SHEETS_SCOPES)
-  sheets_wrapper = SheetsWrapper(sheets_creds, SPREADSHEET_ID)
+  sheets_wrapper = SheetsWrapper(
+      sheets_creds, SPREADSHEET_ID, cache=True, journal=args.journal, append_only=["Caller History"],
+      snapshot_path=None if args.db else args.snapshot)
+  if args.db:
+    sheets_wrapper = SqliteBackend(args.db, mirror=sheets_wrapper)
 
   intents = discord.Intents.default()
   intents.members = True
   intents.message_content = True
-  logging.basicConfig(level=logging.INFO)
   bot = commands.Bot("!", intents=intents)
 
   async with bot:
-    loader_cog = LoaderCog(bot, sheets_wrapper, args.config, args.schema)
+    # Read the lists while connecting to the gateway rather than on the first command.
+    warm_up = asyncio.ensure_future(sheets_wrapper.async_.warm_up(warm_sheets))
+    loader_cog = LoaderCog(bot, sheets_wrapper, args.config, args.schema, args.metrics, warm_up, started)
     await bot.add_cog(loader_cog)
-    await bot.start(DISCORD_TOKEN)
+    try:
+      await bot.start(DISCORD_TOKEN)
+    finally:
+      try:
+        sheets_wrapper.save_snapshot()
+      except Exception as error:
+        logger.warning("Unable to save the snapshot.", exc_info=error)
 
 
 if __name__ == "__main__":
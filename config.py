@@ -1,7 +1,11 @@
+import copy
 import discord
 import json
 import jsonschema
 import logging
+import os
+import stat
+import tempfile
 
 
 from discord import app_commands
@@ -19,29 +23,70 @@ class ConfigWrapper:
 
   By convention, it will return None for missing Discord objects to let the
   caller decide how to handle this.
+
+  The config is kept in memory and only reread when the file's mtime or size
+  changes, so accessors are cheap enough to call on every command.
   """
   def __init__(self, config_path: str, schema_path: str, guild: discord.Guild):
     self.config_path = config_path
     self.schema_path = schema_path
     self.guild = guild
+    with open(self.schema_path, "r") as f:
+      schema = json.load(f)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    self.validator = validator_class(schema)
+    self.config = {}
+    self.file_stat = None
+    self.validated = False
+    # Message handles keyed by the "channel_id-message_id" config value.
+    self.messages: dict[str, discord.PartialMessage] = {}
     # Read once to validate.
     self.read()
 
-  def read(self, validate: bool=True) -> dict:
-    with open(self.config_path, "r") as f:
-      config = json.load(f)
-    with open(self.schema_path, "r") as f:
-      schema = json.load(f)
-    jsonschema.validate(config, schema)
+  def _load(self) -> dict:
+    """Returns the cached config, rereading the file if it has changed."""
+    stat = os.stat(self.config_path)
+    file_stat = (stat.st_mtime_ns, stat.st_size)
+    if file_stat != self.file_stat:
+      with open(self.config_path, "r") as f:
+        self.config = json.load(f)
+      self.file_stat = file_stat
+      self.validated = False
+    return self.config
+
+  def _config(self) -> dict:
+    """Returns the validated cached config. Callers must not modify it."""
+    config = self._load()
+    if not self.validated:
+      self.validator.validate(config)
+      self.validated = True
     return config
 
+  def read(self, validate: bool=True) -> dict:
+    config = self._config() if validate else self._load()
+    return copy.deepcopy(config)
+
   def write(self, config: dict, validate: bool=True):
     if validate:
-      with open(self.schema_path, "r") as f:
-        schema = json.load(f)
-      jsonschema.validate(config, schema)
-    with open(self.config_path, "w") as f:
+      self.validator.validate(config)
+    # Write to a temp file and rename it so readers never see a partial file.
+    directory = os.path.dirname(os.path.abspath(self.config_path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
       json.dump(config, f, sort_keys=True, indent=2)
+    try:
+      # Temp files are only readable by their owner, so keep the config's permissions.
+      os.chmod(f.name, stat.S_IMODE(os.stat(self.config_path).st_mode))
+      os.replace(f.name, self.config_path)
+    except OSError:
+      os.remove(f.name)
+      raise
+    file_stat = os.stat(self.config_path)
+    self.config = copy.deepcopy(config)
+    self.file_stat = (file_stat.st_mtime_ns, file_stat.st_size)
+    self.validated = validate
+    # The message ids may have changed.
+    self.messages.clear()
 
   def embed(self) -> discord.Embed:
     embed = discord.Embed(title=self.config_path)
@@ -59,11 +104,11 @@ class ConfigWrapper:
       return f.read()
 
   # TODO: These don't need to be async.
-  async def callers_message(self) -> Optional[discord.Message]:
-    return await self._get_message("callers_message")
+  async def callers_message(self, fetch: bool=False) -> Optional[discord.PartialMessage]:
+    return await self._get_message("callers_message", fetch)
 
-  async def requests_message(self) -> Optional[discord.Message]:
-    return await self._get_message("requests_message")
+  async def requests_message(self, fetch: bool=False) -> Optional[discord.PartialMessage]:
+    return await self._get_message("requests_message", fetch)
 
   async def callers_role(self) -> Optional[discord.Role]:
     return self._get_role("callers_role")
@@ -84,14 +129,30 @@ class ConfigWrapper:
     return None
 
   def requests_timeout(self) -> int:
-    config = self.read()
+    config = self._config()
     return config["requests_timeout"]
 
-  async def _get_message(self, key: str) -> Optional[discord.Message]:
-    config = self.read()
+  def refresh_window(self) -> float:
+    """The minimum number of seconds between edits to a list message."""
+    config = self._config()
+    return config.get("refresh_window", 2)
+
+  async def _get_message(self, key: str, fetch: bool=False) -> Optional[discord.PartialMessage]:
+    """
+    Returns a handle for the message which can be edited without fetching it.
+
+    Pass fetch=True to check the message still exists, e.g. after an edit
+    fails with NotFound.
+    """
+    config = self._config()
+    value = config[key]
+    if value in self.messages and not fetch:
+      return self.messages[value]
+    self.messages.pop(value, None)
+
     # The key for a message is in the form "channel_id-message_id"
     try:
-      channel_id, message_id = config[key].split("-")
+      channel_id, message_id = value.split("-")
       channel_id = int(channel_id)
       message_id = int(message_id)
     except ValueError:
@@ -100,14 +161,22 @@ class ConfigWrapper:
     channel = self.guild.get_channel(channel_id)
     if not channel or not isinstance(channel, discord.TextChannel):
       return None
-    return await channel.fetch_message(message_id)
+    if fetch:
+      try:
+        message = await channel.fetch_message(message_id)
+      except discord.NotFound:
+        return None
+    else:
+      message = channel.get_partial_message(message_id)
+    self.messages[value] = message
+    return message
 
   def _get_role(self, key: str) -> Optional[discord.Role]:
-    config = self.read()
+    config = self._config()
     return self.guild.get_role(config[key])
 
   def _get_channel(self, key: str) -> Optional[discord.abc.GuildChannel]:
-    config = self.read()
+    config = self._config()
     return self.guild.get_channel(config[key])
 
 
@@ -133,7 +202,8 @@ class ConfigCog(commands.GroupCog, group_name="cfg"):
       requests_message="A message id for the requests list in the form channel_id-message_id",
       show_vc="The voice channel for the live show.",
       terminal="The text channel where bot should send logs.",
-      requests_timeout="The number of days a user can be on the requests list before being automatically removed.")
+      requests_timeout="The number of days a user can be on the requests list before being automatically removed.",
+      refresh_window="The minimum number of seconds between edits to a list message.")
   async def set(self, itx: discord.Interaction,
       callers_role: Optional[discord.Role],
       requests_role: Optional[discord.Role],
@@ -141,9 +211,11 @@ class ConfigCog(commands.GroupCog, group_name="cfg"):
       requests_message: Optional[str],
       show_vc: Optional[discord.VoiceChannel],
       terminal: Optional[discord.TextChannel],
-      requests_timeout: Optional[int]):
+      requests_timeout: Optional[int],
+      refresh_window: Optional[float]):
     """Sets the values of fields in the bot's Discord config file."""
-    if not any([callers_role, requests_role, show_vc, callers_message, requests_message, terminal, requests_timeout]):
+    if not any([callers_role, requests_role, show_vc, callers_message, requests_message, terminal, requests_timeout,
+        refresh_window is not None]):
       await itx.response.send_message("At least one option must be provided!")
       return
 
@@ -162,5 +234,7 @@ class ConfigCog(commands.GroupCog, group_name="cfg"):
       config["terminal_tc"] = terminal.id
     if requests_timeout:
       config["requests_timeout"] = requests_timeout
+    if refresh_window is not None:
+      config["refresh_window"] = refresh_window
     self.config_wrapper.write(config)
     await itx.response.send_message(f"Successfully updated config!", embed=self.config_wrapper.embed())
@@ -0,0 +1,116 @@
+"""A module for tracking when users on a list are due to expire.
+
+Usage:
+  queue = ExpiryQueue()
+  queue.add(user_id, date_added)
+  await queue.wait(lifetime, max_wait=60 * 60)
+  due_ids = queue.pop_due(datetime.today() - lifetime)
+
+  marker = queue.mark()
+  entries = ...  # Reread the sheet.
+  queue.reset(entries, since=marker)
+
+  Entries are ordered by the date they were added rather than by deadline,
+  so changing the lifetime doesn't require rebuilding the heap. Changes
+  made while the sheet is being reread are applied on top of the reset.
+"""
+
+
+import asyncio
+import heapq
+
+
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+
+class ExpiryQueue:
+  """A min-heap of (date_added, user_id) with lazy removal."""
+  def __init__(self):
+    self.heap: list[tuple[datetime, int]] = []
+    self.dates: dict[int, datetime] = {}
+    self.changed = asyncio.Event()
+    # The last change to each user since the last reset, as (version, date_added),
+    # with None for a removal.
+    self.version = 0
+    self.recent: dict[int, tuple[int, Optional[datetime]]] = {}
+
+  def __len__(self):
+    return len(self.dates)
+
+  def mark(self) -> int:
+    """Returns a marker for reset(), taken before reading the entries."""
+    return self.version
+
+  def _record(self, user_id: int, date_added: Optional[datetime]):
+    self.version += 1
+    self.recent[user_id] = (self.version, date_added)
+
+  def reset(self, entries: Iterable[tuple[int, datetime]], since: Optional[int]=None):
+    """
+    Replaces the queue with (user_id, date_added) entries. Changes made after
+    the `since` marker are kept, since the entries were read before them.
+    """
+    self.dates = {}
+    for user_id, date_added in entries:
+      # Keep the earliest date, like a scan of the sheet would.
+      if user_id not in self.dates:
+        self.dates[user_id] = date_added
+    if since is not None:
+      for user_id, (version, date_added) in self.recent.items():
+        if version <= since:
+          continue
+        if date_added is None:
+          self.dates.pop(user_id, None)
+        else:
+          self.dates[user_id] = date_added
+    self.recent = {}
+    self.heap = [(date_added, user_id) for user_id, date_added in self.dates.items()]
+    heapq.heapify(self.heap)
+    self.changed.set()
+
+  def add(self, user_id: int, date_added: datetime):
+    self._record(user_id, date_added)
+    self.dates[user_id] = date_added
+    heapq.heappush(self.heap, (date_added, user_id))
+    self.changed.set()
+
+  def discard(self, user_id: int):
+    # The heap entry is skipped when it reaches the top.
+    self._record(user_id, None)
+    self.dates.pop(user_id, None)
+
+  def peek(self) -> Optional[datetime]:
+    """Returns the earliest date_added in the queue."""
+    while self.heap:
+      date_added, user_id = self.heap[0]
+      if self.dates.get(user_id) == date_added:
+        return date_added
+      heapq.heappop(self.heap)
+    return None
+
+  def pop_due(self, cutoff: datetime) -> list[int]:
+    """Removes and returns the users added at or before the cutoff."""
+    due = []
+    while True:
+      date_added = self.peek()
+      if date_added is None or date_added > cutoff:
+        return due
+      _, user_id = heapq.heappop(self.heap)
+      del self.dates[user_id]
+      self._record(user_id, None)
+      due.append(user_id)
+
+  async def wait(self, lifetime: timedelta, max_wait: float):
+    """Sleeps until the next entry is due, the queue changes, or max_wait passes."""
+    self.changed.clear()
+    date_added = self.peek()
+    delay = max_wait
+    if date_added is not None:
+      delay = min(delay, (date_added + lifetime - datetime.today()).total_seconds())
+    if delay <= 0:
+      return
+    try:
+      await asyncio.wait_for(self.changed.wait(), delay)
+    except asyncio.TimeoutError:
+      pass
@@ -0,0 +1,207 @@
+"""An in-memory stand-in for the Google Sheets v4 service.
+
+Usage:
+  service = FakeSheetsService({"Requests": [["ID", "Name", "Date"], ...]})
+  sheets_wrapper = SheetsWrapper(None, "fake", cache=True, service=service)
+  ...
+  print(len(service.calls), sum(call.response_bytes for call in service.calls))
+
+  Only the calls SheetsWrapper makes are supported. Values are stored the
+  way RAW input stores them and read back like UNFORMATTED_VALUE, with
+  trailing empty cells and rows left out as Sheets does. Every executed
+  request is recorded in `calls` with the size of its payloads.
+"""
+
+
+import copy
+import json
+import re
+import threading
+import time
+
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Call:
+  method: str
+  request_bytes: int
+  response_bytes: int
+  seconds: float
+
+
+def column_index(letters: str) -> int:
+  """Returns the 0-based index of a column like "A" or "AB"."""
+  index = 0
+  for letter in letters:
+    index = index * 26 + ord(letter) - ord("A") + 1
+  return index - 1
+
+
+def column_letters(index: int) -> str:
+  letters = ""
+  index += 1
+  while index:
+    index, remainder = divmod(index - 1, 26)
+    letters = chr(ord("A") + remainder) + letters
+  return letters
+
+
+def parse_range(a1_range: str) -> tuple[str, int, Optional[int], int, Optional[int]]:
+  """Returns (sheet, first_row, last_row, first_column, last_column), 0-based and inclusive."""
+  sheet, _, cells = a1_range.partition("!")
+  sheet = sheet.strip("'")
+  if not cells:
+    return sheet, 0, None, 0, None
+  start, _, end = cells.partition(":")
+  start_column, start_row = re.fullmatch(r"([A-Z]*)(\d*)", start).groups()
+  end_column, end_row = re.fullmatch(r"([A-Z]*)(\d*)", end or start).groups()
+  return (
+      sheet,
+      int(start_row) - 1 if start_row else 0,
+      int(end_row) - 1 if end_row else None,
+      column_index(start_column) if start_column else 0,
+      column_index(end_column) if end_column else None)
+
+
+def trim(rows: list[list]) -> list[list]:
+  """Drops trailing empty cells and rows like Sheets responses do."""
+  rows = [list(row) for row in rows]
+  for row in rows:
+    while row and row[-1] == "":
+      row.pop()
+  while rows and not rows[-1]:
+    rows.pop()
+  return rows
+
+
+class FakeRequest:
+  def __init__(self, service: "FakeSheetsService", method: str, body, handler):
+    self.service = service
+    self.method = method
+    # Named like googleapiclient's HttpRequest.methodId.
+    self.methodId = f"sheets.spreadsheets.{method}"
+    self.body = body
+    self.handler = handler
+
+  def execute(self):
+    start = time.perf_counter()
+    with self.service.lock:
+      response = self.handler()
+      self.service.calls.append(Call(
+          self.method,
+          len(json.dumps(self.body)) if self.body is not None else 0,
+          len(json.dumps(response)),
+          time.perf_counter() - start))
+      return copy.deepcopy(response)
+
+
+class FakeValues:
+  def __init__(self, service: "FakeSheetsService"):
+    self.service = service
+
+  def get(self, spreadsheetId, range, **kwargs):
+    return FakeRequest(self.service, "values.get", None, lambda: self.service.read(range))
+
+  def batchGet(self, spreadsheetId, ranges, **kwargs):
+    return FakeRequest(
+        self.service, "values.batchGet", None,
+        lambda: {"valueRanges": [self.service.read(r) for r in ranges]})
+
+  def append(self, spreadsheetId, range, body, **kwargs):
+    return FakeRequest(self.service, "values.append", body, lambda: self.service.append(range, body))
+
+  def update(self, spreadsheetId, range, body, **kwargs):
+    return FakeRequest(self.service, "values.update", body, lambda: self.service.update(range, body))
+
+
+class FakeSpreadsheets:
+  def __init__(self, service: "FakeSheetsService"):
+    self.service = service
+
+  def values(self):
+    return FakeValues(self.service)
+
+  def get(self, spreadsheetId, **kwargs):
+    return FakeRequest(self.service, "get", None, self.service.properties)
+
+  def batchUpdate(self, spreadsheetId, body):
+    return FakeRequest(self.service, "batchUpdate", body, lambda: self.service.batch_update(body))
+
+
+class FakeSheetsService:
+  """Holds each sheet as a list of rows, including the header."""
+  def __init__(self, sheets: dict[str, list[list]]):
+    self.sheets = {title: [[str(v) for v in row] for row in rows] for title, rows in sheets.items()}
+    self.sheet_ids = {title: i for i, title in enumerate(sheets)}
+    self.calls: list[Call] = []
+    self.lock = threading.Lock()
+
+  def spreadsheets(self):
+    return FakeSpreadsheets(self)
+
+  def _title(self, sheet_id: int) -> str:
+    return next(title for title, i in self.sheet_ids.items() if i == sheet_id)
+
+  def _write(self, sheet: str, index: int, values: list, column: int=0):
+    rows = self.sheets[sheet]
+    while len(rows) <= index:
+      rows.append([])
+    row = rows[index]
+    while len(row) < column + len(values):
+      row.append("")
+    row[column:column + len(values)] = values
+
+  def _next_row(self, sheet: str) -> int:
+    return len(trim(self.sheets[sheet]))
+
+  def properties(self) -> dict:
+    return {"sheets": [
+        {"properties": {"sheetId": i, "title": title}} for title, i in self.sheet_ids.items()]}
+
+  def read(self, a1_range: str) -> dict:
+    sheet, first_row, last_row, first_column, last_column = parse_range(a1_range)
+    rows = self.sheets[sheet][first_row:None if last_row is None else last_row + 1]
+    rows = trim([row[first_column:None if last_column is None else last_column + 1] for row in rows])
+    response = {"range": a1_range, "majorDimension": "ROWS"}
+    if rows:
+      response["values"] = rows
+    return response
+
+  def append(self, a1_range: str, body: dict) -> dict:
+    sheet = parse_range(a1_range)[0]
+    index = self._next_row(sheet)
+    values = body["values"]["values"]
+    self._write(sheet, index, values)
+    return {"updates": {
+        "updatedRange": f"'{sheet}'!A{index + 1}:{column_letters(len(values) - 1)}{index + 1}"}}
+
+  def update(self, a1_range: str, body: dict) -> dict:
+    sheet, first_row, _, first_column, _ = parse_range(a1_range)
+    self._write(sheet, first_row, body["values"]["values"], first_column)
+    return {"updatedRange": a1_range}
+
+  def batch_update(self, body: dict) -> dict:
+    for request in body["requests"]:
+      if "appendCells" in request:
+        append = request["appendCells"]
+        sheet = self._title(append["sheetId"])
+        for row in append["rows"]:
+          values = [cell["userEnteredValue"]["stringValue"] for cell in row["values"]]
+          self._write(sheet, self._next_row(sheet), values)
+      elif "updateCells" in request:
+        update = request["updateCells"]
+        start = update["start"]
+        sheet = self._title(start["sheetId"])
+        for offset, row in enumerate(update["rows"]):
+          values = [cell["userEnteredValue"]["stringValue"] for cell in row["values"]]
+          self._write(sheet, start["rowIndex"] + offset, values, start["columnIndex"])
+      elif "deleteDimension" in request:
+        dimension = request["deleteDimension"]["range"]
+        rows = self.sheets[self._title(dimension["sheetId"])]
+        del rows[dimension["startIndex"]:dimension["endIndex"]]
+      else:
+        raise NotImplementedError(f"Unsupported batchUpdate request: {list(request)}")
+    return {"replies": [{} for _ in body["requests"]]}
@@ -0,0 +1,157 @@
+"""A module for collecting latency histograms, counters and gauges in memory.
+
+Usage:
+  with timed("sheets_request_seconds", method="values.get"):
+    ...
+  count("command_errors_total", command="screenme")
+  gauge("executor_queue_depth", lambda: len(queue))
+
+  print(render())  # Prometheus text format.
+
+  Everything is kept in one process-wide registry, so any module can record
+  metrics without passing objects around. Histograms use fixed buckets, so
+  memory stays constant no matter how long the bot runs.
+"""
+
+
+import bisect
+import os
+import threading
+import time
+
+
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+prefix = "callbot_"
+# Upper bounds in seconds, from a cache hit to a slow Sheets call.
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+  def __init__(self):
+    # One count per bucket, plus one for everything over the last bound.
+    self.counts = [0] * (len(buckets) + 1)
+    self.count = 0
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+
+  def quantile(self, q: float) -> float:
+    """Returns the upper bound of the bucket containing the quantile."""
+    rank = q * self.count
+    seen = 0
+    for bound, bucket_count in zip(buckets, self.counts):
+      seen += bucket_count
+      if seen >= rank:
+        return bound
+    return float("inf")
+
+
+lock = threading.Lock()
+histograms: dict[tuple[str, Labels], Histogram] = {}
+counters: dict[tuple[str, Labels], float] = {}
+gauges: dict[tuple[str, Labels], Callable[[], float]] = {}
+
+
+def _key(name: str, labels: dict) -> tuple[str, Labels]:
+  return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+  key = _key(name, labels)
+  with lock:
+    if key not in histograms:
+      histograms[key] = Histogram()
+    histograms[key].observe(value)
+
+
+def count(name: str, amount: float=1, **labels):
+  key = _key(name, labels)
+  with lock:
+    counters[key] = counters.get(key, 0) + amount
+
+
+def gauge(name: str, callback: Callable[[], float], **labels):
+  """Registers a callback which is read whenever metrics are rendered."""
+  with lock:
+    gauges[_key(name, labels)] = callback
+
+
+@contextmanager
+def timed(name: str, **labels):
+  """Observes the block's duration in `name`, counting exceptions in `name`_errors_total."""
+  start = time.perf_counter()
+  try:
+    yield
+  except BaseException:
+    count(f"{name.removesuffix('_seconds')}_errors_total", **labels)
+    raise
+  finally:
+    observe(name, time.perf_counter() - start, **labels)
+
+
+def _labels(labels: Labels, extra: Optional[tuple[str, str]]=None) -> str:
+  pairs = list(labels) + ([extra] if extra else [])
+  if not pairs:
+    return ""
+  escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+  return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def render() -> str:
+  """Returns every metric in the Prometheus text exposition format."""
+  lines = []
+  typed = set()
+  def declare(name: str, kind: str):
+    if name not in typed:
+      typed.add(name)
+      lines.append(f"# TYPE {prefix}{name} {kind}")
+
+  with lock:
+    for (name, labels), histogram in sorted(histograms.items()):
+      declare(name, "histogram")
+      cumulative = 0
+      for bound, bucket_count in zip(buckets, histogram.counts):
+        cumulative += bucket_count
+        lines.append(f"{prefix}{name}_bucket{_labels(labels, ('le', str(bound)))} {cumulative}")
+      lines.append(f"{prefix}{name}_bucket{_labels(labels, ('le', '+Inf'))} {histogram.count}")
+      lines.append(f"{prefix}{name}_sum{_labels(labels)} {histogram.sum}")
+      lines.append(f"{prefix}{name}_count{_labels(labels)} {histogram.count}")
+    for (name, labels), value in sorted(counters.items()):
+      declare(name, "counter")
+      lines.append(f"{prefix}{name}{_labels(labels)} {value}")
+    gauge_items = sorted(gauges.items())
+
+  # Read gauges outside the lock since their callbacks take other locks.
+  for (name, labels), callback in gauge_items:
+    declare(name, "gauge")
+    lines.append(f"{prefix}{name}{_labels(labels)} {callback()}")
+  return "\n".join(lines) + "\n"
+
+
+def write(path: str):
+  """Writes render() to a file for a Prometheus textfile collector, atomically."""
+  temp_path = f"{path}.tmp"
+  with open(temp_path, "w") as metrics_file:
+    metrics_file.write(render())
+  os.replace(temp_path, path)
+
+
+def snapshot() -> tuple[dict, dict, dict]:
+  """Returns copies of the histograms, counters and gauge values, e.g. for a summary."""
+  with lock:
+    copies = {}
+    for key, histogram in histograms.items():
+      copy = Histogram()
+      copy.counts, copy.count, copy.sum = list(histogram.counts), histogram.count, histogram.sum
+      copies[key] = copy
+    counter_values = dict(counters)
+    gauge_items = list(gauges.items())
+  return copies, counter_values, {key: callback() for key, callback in gauge_items}
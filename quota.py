@@ -0,0 +1,204 @@
+"""A module for keeping Google Sheets API calls within the per-minute quotas.
+
+Usage:
+  quota = QuotaScheduler(reads_per_minute=60, writes_per_minute=60)
+  result = quota.execute(sheets.values().get(...), "read")
+
+  with background():
+    ...  # Calls made here wait behind interactive ones.
+
+  with quota.reserve("read"):
+    with lock:
+      quota.execute(...)  # Uses the token taken before the lock.
+
+  Each kind of call draws from its own token bucket. When a bucket runs dry,
+  calls queue up and are let through as tokens refill, interactive calls
+  before background ones and otherwise in the order they arrived. The
+  priority is a context variable, so it follows calls onto the `threaded`
+  lanes. A 429 from Sheets empties the bucket for a backoff period and the
+  call is retried. Reserving a token before taking a lock keeps the wait for
+  quota from holding up everything else that needs the lock.
+"""
+
+
+import heapq
+import itertools
+import logging
+import metrics
+import threading
+import time
+import tracing
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from googleapiclient.errors import HttpError
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+priority: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+# The unused tokens reserved by reserve(), by kind.
+reserved: ContextVar[Optional[dict[str, int]]] = ContextVar("reserved", default=None)
+
+
+@contextmanager
+def background():
+  """Runs the Sheets calls made in the block at background priority."""
+  token = priority.set(BACKGROUND)
+  try:
+    yield
+  finally:
+    priority.reset(token)
+
+
+def in_background(f):
+  """Decorates a coroutine, e.g. a tasks.loop body, to run at background priority."""
+  @wraps(f)
+  async def wrapper(*args, **kwargs):
+    with background():
+      return await f(*args, **kwargs)
+  return wrapper
+
+
+class TokenBucket:
+  """Tokens refill continuously at `per_minute`, up to a minute's worth."""
+  def __init__(self, per_minute: float):
+    self.rate = per_minute / 60
+    self.capacity = per_minute
+    self.tokens = per_minute
+    self.updated = time.monotonic()
+    # (priority, sequence) for each call waiting on a token.
+    self.waiting: list[tuple[int, int]] = []
+
+  def refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def wait_time(self) -> float:
+    """Returns the seconds until a whole token is available."""
+    return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class QuotaScheduler:
+  """Lets Sheets API calls through at the quota's rate, interactive calls first."""
+  def __init__(self, reads_per_minute: float=60, writes_per_minute: float=60, max_retries: int=5):
+    self.condition = threading.Condition()
+    self.buckets = {
+        "read": TokenBucket(reads_per_minute),
+        "write": TokenBucket(writes_per_minute),
+        }
+    self.max_retries = max_retries
+    self.sequence = itertools.count()
+    for kind in self.buckets:
+      metrics.gauge("sheets_quota_queued", lambda kind=kind: self.stats()[kind]["queued"], kind=kind)
+      metrics.gauge("sheets_quota_remaining", lambda kind=kind: self.stats()[kind]["remaining"], kind=kind)
+
+  def acquire(self, kind: str):
+    """Blocks until the call is at the front of the queue and a token is available."""
+    bucket = self.buckets[kind]
+    ticket = (priority.get(), next(self.sequence))
+    with self.condition:
+      heapq.heappush(bucket.waiting, ticket)
+      try:
+        while True:
+          bucket.refill()
+          if bucket.waiting[0] == ticket and bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return
+          # Only the front of the queue needs to watch the clock; the rest
+          # are woken when it leaves.
+          self.condition.wait(bucket.wait_time() if bucket.waiting[0] == ticket else None)
+      finally:
+        bucket.waiting.remove(ticket)
+        heapq.heapify(bucket.waiting)
+        self.condition.notify_all()
+
+  def release(self, kind: str):
+    """Gives back a token which was acquired but not used."""
+    bucket = self.buckets[kind]
+    with self.condition:
+      bucket.refill()
+      bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+      self.condition.notify_all()
+
+  @contextmanager
+  def reserve(self, *kinds: str):
+    """
+    Takes a token for each call of the listed kinds made in the block, e.g.
+    ("read", "read") for two reads, less any still unused from an enclosing
+    block. Unused tokens are given back.
+    """
+    tokens = reserved.get()
+    outermost = tokens is None
+    if outermost:
+      tokens = {}
+      context_token = reserved.set(tokens)
+    taken = {}
+    try:
+      for kind in dict.fromkeys(kinds):
+        for _ in range(kinds.count(kind) - tokens.get(kind, 0)):
+          with metrics.timed("sheets_quota_wait_seconds", kind=kind):
+            self.acquire(kind)
+          tokens[kind] = tokens.get(kind, 0) + 1
+          taken[kind] = taken.get(kind, 0) + 1
+      yield
+    finally:
+      for kind, count in taken.items():
+        unused = min(count, tokens.get(kind, 0))
+        tokens[kind] -= unused
+        for _ in range(unused):
+          self.release(kind)
+      if outermost:
+        reserved.reset(context_token)
+
+  def throttle(self, kind: str, seconds: float):
+    """Holds back every call of this kind for the given time."""
+    bucket = self.buckets[kind]
+    with self.condition:
+      bucket.refill()
+      bucket.tokens = min(bucket.tokens, -seconds * bucket.rate)
+      self.condition.notify_all()
+
+  def execute(self, request, kind: str):
+    """Executes a googleapiclient request within the quota, retrying on 429s."""
+    method = getattr(request, "methodId", kind).removeprefix("sheets.spreadsheets.")
+    for attempt in range(self.max_retries + 1):
+      submitted = time.perf_counter()
+      tokens = reserved.get()
+      if attempt == 0 and tokens and tokens.get(kind):
+        tokens[kind] -= 1
+      else:
+        with metrics.timed("sheets_quota_wait_seconds", kind=kind):
+          self.acquire(kind)
+      try:
+        # The span's wait is the time spent waiting for quota.
+        with metrics.timed("sheets_request_seconds", method=method), \
+            tracing.span(f"sheets {method}", submitted=submitted):
+          return request.execute()
+      except HttpError as error:
+        metrics.count("sheets_http_errors_total", method=method, status=error.resp.status)
+        if error.resp.status != 429 or attempt == self.max_retries:
+          raise
+        backoff = 2 ** attempt
+        logger.warning(f"Sheets {kind} quota exceeded, backing off for {backoff}s.")
+        self.throttle(kind, backoff)
+
+  def stats(self) -> dict[str, dict[str, int]]:
+    """Returns the queue depth and remaining budget of each kind of call."""
+    with self.condition:
+      stats = {}
+      for kind, bucket in self.buckets.items():
+        bucket.refill()
+        stats[kind] = {
+            "queued": len(bucket.waiting),
+            "queued_interactive": sum(1 for p, _ in bucket.waiting if p == INTERACTIVE),
+            "remaining": max(0, int(bucket.tokens)),
+            }
+      return stats
@@ -0,0 +1,107 @@
+"""A module for the typed rows of each sheet.
+
+Usage:
+  rows = decode_rows("Requests", [["1234", "name", "2024-01-01T00:00:00"], []])
+  rows[0].id, rows[0].name, rows[0].date  # 1234, "name", datetime(2024, 1, 1)
+  rows[1]  # None, for an empty row.
+  rows[0].values()  # The cells again, for storing the row.
+
+  Only the id is converted to an int, and dates are parsed once when a row
+  is read. Everything else stays the string Sheets returned, so a name made
+  of digits stays a name.
+"""
+
+
+from datetime import datetime
+from typing import Optional
+
+
+def parse_id(value):
+  # User ids are stored as strings since they're too big for Sheets' numbers.
+  if isinstance(value, str) and value.isdigit():
+    return int(value)
+  return value
+
+
+def parse_date(value):
+  """Returns a datetime, or the value as is if it isn't an ISO date, e.g. from a manual edit."""
+  if isinstance(value, str):
+    try:
+      return datetime.fromisoformat(value)
+    except ValueError:
+      pass
+  return value
+
+
+class Row:
+  """A row with a slot for each column. Missing trailing cells are None."""
+  __slots__ = ()
+  columns: tuple[str, ...] = ()
+
+  def __init__(self, *cells):
+    for i, column in enumerate(self.columns):
+      setattr(self, column, cells[i] if i < len(cells) else None)
+
+  @classmethod
+  def decode(cls, cells: list) -> "Row":
+    row = cls(*cells)
+    row.id = parse_id(row.id)
+    if "date" in cls.columns:
+      row.date = parse_date(row.date)
+    return row
+
+  def values(self) -> list:
+    """Returns the cells as they'd be written, without trailing empty cells."""
+    cells = []
+    for column in self.columns:
+      value = getattr(self, column)
+      cells.append(value.isoformat() if isinstance(value, datetime) else value)
+    while cells and cells[-1] is None:
+      cells.pop()
+    return ["" if value is None else value for value in cells]
+
+  def __eq__(self, other):
+    return type(self) is type(other) and self.values() == other.values()
+
+  def __repr__(self):
+    fields = ", ".join(f"{column}={getattr(self, column)!r}" for column in self.columns)
+    return f"{type(self).__name__}({fields})"
+
+
+class RequestRow(Row):
+  __slots__ = columns = ("id", "name", "date")
+
+
+class CallerRow(Row):
+  __slots__ = columns = ("id", "name", "european", "date")
+
+
+class HistoryRow(Row):
+  __slots__ = columns = ("id", "name", "date")
+
+
+class DeniedRow(Row):
+  __slots__ = columns = ("id", "name", "reason", "date")
+
+
+schemas: dict[str, type[Row]] = {
+    "Requests": RequestRow,
+    "New Callers": CallerRow,
+    "Repeat Callers": CallerRow,
+    "Caller History": HistoryRow,
+    "Denied Requests": DeniedRow,
+    }
+
+
+def decode(sheet: str, values: list) -> Optional[Row]:
+  """Decodes values being written to the sheet into the row a read would return."""
+  if not values:
+    return None
+  # Values are written as strings, so convert them the same way first.
+  return schemas[sheet].decode([str(value) for value in values])
+
+
+def decode_rows(sheet: str, rows: list[list]) -> list[Optional[Row]]:
+  """Decodes rows read from the sheet, with None for each empty row."""
+  row_type = schemas[sheet]
+  return [row_type.decode(cells) if cells else None for cells in rows]
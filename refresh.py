@@ -0,0 +1,54 @@
+"""A module for coalescing bursts of refreshes into a single run.
+
+Usage:
+  scheduler = RefreshScheduler(update_message, window=lambda: 2)
+  scheduler.schedule()  # Marks the message dirty and returns immediately.
+
+  Calls to schedule() made while a refresh is pending are folded into it,
+  and refreshes start at most once per window seconds.
+"""
+
+
+import asyncio
+import logging
+
+
+from typing import Awaitable, Callable
+
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+  """Runs a refresh callback in the background, at most once per window."""
+  def __init__(self, callback: Callable[[], Awaitable], window: Callable[[], float]):
+    self.callback = callback
+    self.window = window
+    self.dirty = False
+    self.last_run = 0.0
+    self.task = None
+
+  def schedule(self):
+    self.dirty = True
+    if not self.task or self.task.done():
+      self.task = asyncio.create_task(self._run())
+
+  async def flush(self):
+    """Schedules a refresh and waits for it to finish."""
+    self.schedule()
+    await self.task
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    while self.dirty:
+      delay = self.last_run + self.window() - loop.time()
+      if delay > 0:
+        await asyncio.sleep(delay)
+      # Clear the flag before running so changes made during the refresh
+      # schedule another one.
+      self.dirty = False
+      self.last_run = loop.time()
+      try:
+        await self.callback()
+      except Exception as error:
+        logger.error("Refresh failed.", exc_info=error)
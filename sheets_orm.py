@@ -1,12 +1,25 @@
 import asyncio
 import discord
+import logging
+import re
+import snapshot
+import threading
+import time
 
 
+from abc import ABC, abstractmethod
+from contextlib import ExitStack, contextmanager
 from global_config import SPREADSHEET_ID, SHEETS_SCOPES
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
-from typing import Optional
-from threaded import threaded
+from typing import Iterable, Optional
+from quota import QuotaScheduler, background
+from records import Row, decode, decode_rows, parse_id, schemas
+from threaded import AsyncFacade, own_lane, threaded
+from write_behind import FlushThread, WriteJournal, retryable
+
+
+logger = logging.getLogger(__name__)
 
 
 def value_list(values: list):
@@ -19,116 +32,924 @@ def value_list(values: list):
       }
   return value_list
 
-def value_multi_list(values_list: list):
-  """Creates a value list with multiple values."""
-  # TODO: consolidate this with value_list()
-  # Each value should be a string since Google Sheets does weird conversions.
-  value_list = {
-      "values": [
-        { "values": [str(v) for v in values] } for values in values_list
-        ]
+def row_data(values: list):
+  """Creates the RowData for batchUpdate requests."""
+  # Use strings for the same reason as value_list().
+  return { "values": [{ "userEnteredValue": { "stringValue": str(v) } } for v in values] }
+
+
+def append_rows_request(sheet_id: int, values_list: list):
+  """Creates a batchUpdate request appending rows after the last row with data."""
+  return {
+      "appendCells": {
+        "sheetId": sheet_id,
+        "rows": [row_data(values) for values in values_list],
+        "fields": "userEnteredValue",
+        }
+      }
+
+
+def update_row_request(sheet_id: int, index: int, values: list):
+  """Creates a batchUpdate request overwriting the start of the row at the 0-based index."""
+  return {
+      "updateCells": {
+        "start": {
+          "sheetId": sheet_id,
+          "rowIndex": index,
+          "columnIndex": 0,
+          },
+        "rows": [row_data(values)],
+        "fields": "userEnteredValue",
+        }
+      }
+
+
+def delete_row_request(sheet_id: int, index: int):
+  """Creates a batchUpdate request deleting the row at the 0-based index."""
+  return {
+      "deleteDimension": {
+        "range": {
+          "sheetId": sheet_id,
+          "dimension": "ROWS",
+          "startIndex": index,
+          "endIndex": index + 1,
+          }
+        }
       }
-  return value_list
 
 
-def restore_ints(value_list):
+def range_row(a1_range: str) -> Optional[int]:
+  """Returns the first row number in an A1 range like "'New Callers'!A5:D5"."""
+  match = re.search(r"![A-Z]*(\d+)", a1_range)
+  return int(match.group(1)) if match else None
+
+
+def projected_range(sheet: str, columns: Iterable[str]) -> str:
+  """Returns the A1 range of the data rows from column A through the last of the named columns."""
+  last = max(schemas[sheet].columns.index(column) for column in columns)
+  return f"'{sheet}'!A2:{chr(ord('A') + last)}"
+
+
+def id_column(rows: list[Optional[Row]]) -> list:
+  """Returns each row's id, or None for rows without one, as a read of just the id column would."""
+  ids = [row.id if row and row.id not in ("", None) else None for row in rows]
+  # Sheets leaves out trailing rows with nothing in the range.
+  while ids and ids[-1] is None:
+    ids.pop()
+  return ids
+
+
+class SheetCache:
   """
-  Restores int values that must be converted to str for Google Sheets due to
-  the size limit on ints.
+  An in-memory copy of a sheet's rows with an index keyed on user_id.
+
+  The rows exclude the header, and empty rows are kept as None so positions
+  match the sheet. That makes the index double as a row number index.
   """
-  for i in range(len(value_list)):
-    for j in range(len(value_list[i])):
-      value = value_list[i][j]
-      if isinstance(value, str) and value.isdigit():
-        value_list[i][j] = int(value)
+  def __init__(self, rows: list[Optional[Row]]):
+    self.rows = rows
+    self.reindex()
+
+  def reindex(self):
+    self.index = {}
+    for i, row in enumerate(self.rows):
+      # Keep the first match to behave like a scan of the sheet.
+      if row and row.id not in self.index:
+        self.index[row.id] = i
+
+  def get(self, user_id: int) -> Optional[Row]:
+    i = self.index.get(user_id)
+    if i is None:
+      return None
+    return self.rows[i]
+
+  def row_number(self, user_id: int) -> Optional[int]:
+    """Returns the 1-indexed sheet row of the user, counting the header."""
+    i = self.index.get(user_id)
+    if i is None:
+      return None
+    return i + 2
+
+  def append(self, row: Row, row_number: Optional[int]=None):
+    """Adds the row where Sheets appends it, or at row_number if Sheets reported where it went."""
+    if row_number is None:
+      # Sheets appends after the last non-empty row, e.g. into blank rows left by a delete.
+      i = len(self.rows)
+      while i and self.rows[i - 1] is None:
+        i -= 1
+    else:
+      i = row_number - 2
+    # Pad any gap before the row Sheets reported.
+    while len(self.rows) <= i:
+      self.rows.append(None)
+    self.rows[i] = row
+    if row.id not in self.index or self.index[row.id] > i:
+      self.index[row.id] = i
+
+  def update(self, row: Row):
+    i = self.index.get(row.id)
+    if i is not None:
+      self.rows[i] = row
+
+  def delete(self, user_ids):
+    self.rows = [row for row in self.rows if (not row) or (row.id not in user_ids)]
+    self.reindex()
+
+
+class AppendOnlyIndex:
+  """
+  The user_ids in a sheet which only ever grows, read a few rows at a time.
+
+  Only the id column is read. `rows` counts the rows ingested so far,
+  including the header, and each read starts again at the last of them to
+  check it still holds `last_cell`. If it doesn't, rows were deleted or
+  edited, and the index must be rebuilt.
+  """
+  def __init__(self):
+    self.ids: set[int] = set()
+    self.rows = 0
+    self.last_cell = None
+    # Whether rows may have been added by hand since the last read.
+    self.stale = True
+
+  def tail_range(self, sheet: str) -> str:
+    return f"'{sheet}'!A{max(self.rows, 1)}:A"
+
+  def ingest(self, cells: list[list]) -> bool:
+    """Adds the rows read from tail_range(), returning False if the sheet no longer matches."""
+    if self.rows:
+      first = cells[0][0] if cells and cells[0] else None
+      if first != self.last_cell:
+        return False
+    # Either the header or the row that was checked.
+    new_rows = cells[1:]
+    for row in new_rows:
+      if row:
+        self.ids.add(parse_id(row[0]))
+    self.rows = max(self.rows, 1) + len(new_rows)
+    if new_rows:
+      # Sheets leaves out trailing empty rows, so the last row has a value.
+      self.last_cell = new_rows[-1][0]
+    elif not self.last_cell and cells and cells[0]:
+      self.last_cell = cells[0][0]
+    self.stale = False
+    return True
+
+
+class StorageBackend(ABC):
+  """
+  The interface the cogs use to read and write the lists.
+
+  Each sheet is a list of rows from records.py, with None for empty rows.
+  Reads can be limited to some `columns`, in which case only those are sure
+  to be filled in. Writes take plain lists of values in column order.
+  Methods are @threaded, and implementations should set
+  `async_ = AsyncFacade(self)` so the event loop can await them.
+  """
+  @abstractmethod
+  def get_all(self, sheet: str, columns: Optional[list[str]]=None) -> list[Optional[Row]]:
+    pass
+
+  @abstractmethod
+  def get(self, sheet: str, user_id: int, columns: Optional[list[str]]=None) -> Optional[Row]:
+    pass
+
+  @abstractmethod
+  def append(self, sheet: str, values: list):
+    pass
+
+  @abstractmethod
+  def update(self, sheet: str, values: list):
+    pass
+
+  @abstractmethod
+  def delete(self, sheet: str, *user_ids: int) -> list[int]:
+    """Deletes the rows matching the user_ids, returning the ids which were found."""
+    pass
+
+  @threaded
+  def find_user(self, user_id: int, sheets: list[str], full_rows: Iterable[str]=()) -> list[str]:
+    """
+    Returns the sheets containing the user. `full_rows` names sheets whose
+    rows will be needed right after, e.g. to render a list, which a backend
+    may read in full now rather than in a second request.
+    """
+    return [sheet for sheet in sheets if self.get(sheet, user_id, columns=["id"])]
+
+  @threaded
+  def move(self, user_id: int, src_sheets: list[str], dst_sheet: str, values: list):
+    """Appends values to dst_sheet and deletes the user's rows from src_sheets."""
+    self.append(dst_sheet, values)
+    for sheet in src_sheets:
+      self.delete(sheet, user_id)
+
+  @threaded
+  def invalidate(self, *sheets: str):
+    """Drops any local copy of the sheets after they were edited by hand."""
+    pass
+
+  @threaded
+  def poll_changes(self, sheets: list[str]) -> list[str]:
+    """Returns the sheets that were changed outside the bot since the last poll."""
+    return []
+
+  @threaded
+  def warm_up(self, sheets: list[str]):
+    """Loads the sheets ahead of the first command, e.g. while the bot connects."""
+    pass
+
+  @threaded
+  def save_snapshot(self):
+    """Saves local state to disk for the next start, if the backend keeps a snapshot."""
+    pass
 
 
 # TODO: Stop using magic strings for the sheet names.
-class SheetsWrapper:
-  """A class which wraps Google Sheets API calls to simplify operations."""
+class SheetsWrapper(StorageBackend):
+  """
+  A class which wraps Google Sheets API calls to simplify operations.
+
+  With `cache` enabled, each sheet is read once and then served from memory.
+  Writes go through to Sheets and update the cache, so `invalidate()` only
+  needs to be called after the spreadsheet is edited by hand. Membership
+  checks and writes only need ids and row positions, so when a sheet's full
+  rows aren't cached they read and cache just its id column.
+
+  Calls for a sheet run in order on that sheet's lane, and different sheets
+  run in parallel. Each sheet also has a lock so that a read which fills the
+  cache can't interleave with a write to the same sheet.
+
+  From the event loop, use the `async_` facade to await calls without
+  tying up a thread, e.g. `await sheets_wrapper.async_.get_all("Requests")`.
+
+  With a `journal` path, appends and updates are write-behind: they update
+  the cache and are committed to a local journal, then a background thread
+  sends them to Sheets in batches. Deletes, moves and reads that fill the
+  cache flush the journal first so row numbers stay valid. Anything left in
+  the journal from a previous run is flushed on startup.
+
+  The service is built on first use from the discovery document bundled
+  with google-api-python-client, so construction is cheap and startup never
+  fetches it over the network. `warm_up()` builds it and fills the cache.
+
+  Every request goes through `quota`, which keeps them within the Sheets
+  per-minute quotas and lets interactive calls go before background ones.
+
+  Membership checks on `append_only` sheets, e.g. Caller History, use an
+  AppendOnlyIndex instead of the full rows. After the first read, only the
+  rows added since are fetched, when the index is invalidated or on every
+  check with the cache off. Deleting from one rebuilds its index.
+
+  With a `snapshot_path`, the cache and append-only indexes are loaded from
+  that file on startup and served right away. `save_snapshot()` writes them
+  back, skipping the write if nothing changed. The next `poll_changes()`
+  reconciles the loaded sheets with Sheets, and the indexes read the rows
+  added since as usual.
+  """
   @threaded
-  def __init__(self, credentials, spreadsheet_id):
+  def __init__(
+      self, credentials, spreadsheet_id, cache: bool=False, journal: Optional[str]=None,
+      quota: Optional[QuotaScheduler]=None, service=None, append_only: Iterable[str]=(),
+      snapshot_path: Optional[str]=None):
+    if journal and not cache:
+      raise ValueError("Write-behind needs the cache so reads can see queued writes.")
+    if snapshot_path and not cache:
+      raise ValueError("A snapshot needs the cache to serve from.")
     self.spreadsheet_id = spreadsheet_id
-    service = build('sheets', 'v4', credentials=credentials)
-    self.sheets = service.spreadsheets()
+    self.credentials = credentials
+    # A prebuilt service, e.g. fake_sheets.FakeSheetsService, skips the build.
+    self.service = service
+    self._sheets = None
+    self.build_lock = threading.Lock()
+    self.cache: Optional[dict[str, SheetCache]] = {} if cache else None
+    # Sheets with only their id column cached. A sheet is in at most one of
+    # the caches, since full rows have the ids too.
+    self.id_cache: Optional[dict[str, SheetCache]] = {} if cache else None
+    self.locks: dict[str, threading.RLock] = {}
+    self.sheet_ids: dict[str, int] = {}
+    # The ids seen by the last poll_changes(), used when the cache is off.
+    self.polled: dict[str, list] = {}
+    self.append_only = {sheet: AppendOnlyIndex() for sheet in append_only}
+    self.async_ = AsyncFacade(self)
+    self.quota = quota or QuotaScheduler()
+    self.journal = WriteJournal(journal) if journal else None
+    self.flush_lock = threading.Lock()
+    self.snapshot_path = snapshot_path
+    # The hash of the last snapshot saved or loaded, to skip saving it again.
+    self.snapshot_hash: Optional[str] = None
+    # Sheets loaded from the snapshot which haven't been checked against Sheets yet.
+    self.unreconciled: set[str] = set()
+    if snapshot_path:
+      self._load_snapshot()
+    if self.journal is not None:
+      self.flusher = FlushThread(self._flush_in_background)
+      self.flusher.start()
+      # Replay anything left over from the last run.
+      self.flusher.wake()
+
+  def _load_snapshot(self):
+    entries = snapshot.load(self.snapshot_path)
+    for sheet, entry in entries.items():
+      if "rows" in entry:
+        self.cache[sheet] = SheetCache(decode_rows(sheet, entry["rows"]))
+        self.unreconciled.add(sheet)
+      if "index" in entry and sheet in self.append_only:
+        # Still stale, so the next check reads on from where the snapshot ended.
+        index = self.append_only[sheet]
+        index.ids = set(entry["index"]["ids"])
+        index.rows = entry["index"]["rows"]
+        index.last_cell = entry["index"]["last_cell"]
+    self.snapshot_hash = snapshot.content_hash(entries)
+
+  @threaded(lane=own_lane)
+  def save_snapshot(self):
+    """Saves the cache and append-only indexes to the snapshot file if they changed."""
+    if not self.snapshot_path:
+      return
+    entries = {}
+    sheets = list(self.cache)
+    with self._locked(*sheets, *self.append_only):
+      for sheet in sheets:
+        cache = self.cache.get(sheet)
+        if cache:
+          entries[sheet] = {"rows": [row.values() if row else [] for row in cache.rows]}
+      for sheet, index in self.append_only.items():
+        if index.rows:
+          entries.setdefault(sheet, {})["index"] = {
+              "ids": sorted(index.ids, key=str), "rows": index.rows, "last_cell": index.last_cell}
+    digest = snapshot.content_hash(entries)
+    if digest == self.snapshot_hash:
+      return
+    snapshot.save(self.snapshot_path, entries)
+    self.snapshot_hash = digest
+
+  @property
+  def sheets(self):
+    """The spreadsheets resource, building the service on first use."""
+    if self._sheets is None:
+      with self.build_lock:
+        if self._sheets is None:
+          start = time.perf_counter()
+          if self.service is None:
+            self.service = build(
+                'sheets', 'v4', credentials=self.credentials, static_discovery=True, cache_discovery=False)
+            logger.info(f"Built the Sheets service in {time.perf_counter() - start:.2f}s.")
+          self._sheets = self.service.spreadsheets()
+    return self._sheets
+
+  def _reserved(self, reads: int=0, writes: int=0, sheet_ids: Iterable[str]=(), flush: bool=False):
+    """
+    Takes the quota tokens a call is expected to need before it takes any
+    locks, so waiting for quota doesn't hold up other calls on its sheets.
+    `sheet_ids` names the sheets whose numeric ids it needs, and `flush`
+    says whether it flushes the journal first.
+    """
+    # Every sheet's id comes from one lookup.
+    lookup = any(sheet not in self.sheet_ids for sheet in sheet_ids)
+    if flush and self._unflushed():
+      # One write, and one read to check the rows of any queued updates.
+      writes += 1
+      reads += 1
+      lookup = lookup or not self.sheet_ids
+    return self.quota.reserve(*["read"] * (reads + lookup), *["write"] * writes)
+
+  def _unflushed(self) -> bool:
+    """Returns whether reading a sheet has to flush the journal first."""
+    return self.journal is not None and len(self.journal) > 0
+
+  @contextmanager
+  def _locked(self, *sheets: str):
+    # Always acquire in the same order to avoid deadlocks.
+    with ExitStack() as stack:
+      for sheet in sorted(set(sheets)):
+        stack.enter_context(self.locks.setdefault(sheet, threading.RLock()))
+      yield
+
+  @threaded(lane=own_lane)
+  def invalidate(self, *sheets: str):
+    """Drops the cached rows for the sheets, or every sheet if none are given."""
+    # Lock so a write in progress can't find its cache gone after it reached Sheets.
+    with self._locked(*(sheets or self.locks)):
+      # Append-only sheets only need to check for new rows.
+      for sheet, index in self.append_only.items():
+        if not sheets or sheet in sheets:
+          index.stale = True
+      if self.cache is None:
+        return
+      if not sheets:
+        self.cache.clear()
+        self.id_cache.clear()
+        self.unreconciled.clear()
+      for sheet in sheets:
+        self.cache.pop(sheet, None)
+        self.id_cache.pop(sheet, None)
+        self.unreconciled.discard(sheet)
+
+  @threaded(lane="sheet")
+  def _cached(self, sheet: str) -> Optional[SheetCache]:
+    """Returns the cache for the sheet, loading it if needed."""
+    if self.cache is None:
+      return None
+    loaded = sheet in self.cache
+    with self._reserved(reads=not loaded, flush=not loaded), self._locked(sheet):
+      if sheet not in self.cache:
+        self.flush()
+        self.cache[sheet] = SheetCache(self._fetch_rows(sheet))
+        self.id_cache.pop(sheet, None)
+      return self.cache[sheet]
+
+  @threaded(lane="sheet")
+  def _ids(self, sheet: str) -> SheetCache:
+    """Returns the sheet's rows with at least their ids, reading only the id column if needed."""
+    loaded = bool(self._local_ids(sheet))
+    with self._reserved(reads=not loaded, flush=not loaded), self._locked(sheet):
+      local = self._local_ids(sheet)
+      if local:
+        return local
+      self.flush()
+      ids = SheetCache(self._fetch_rows(sheet, ["id"]))
+      if self.id_cache is not None and not self._local(sheet):
+        self.id_cache[sheet] = ids
+      return ids
+
+  def _local(self, sheet: str) -> Optional[SheetCache]:
+    """Returns whichever copy of the sheet is cached, for reads and for writes to keep current."""
+    if self.cache is None:
+      return None
+    return self.cache.get(sheet) or self.id_cache.get(sheet)
+
+  def _local_ids(self, sheet: str) -> Optional[SheetCache]:
+    """Returns the cached copy of the sheet if its row numbers can be used for writes."""
+    if sheet in self.unreconciled:
+      # Rows loaded from a snapshot may have moved since it was saved.
+      return None
+    return self._local(sheet)
+
+  def flush(self):
+    """
+    Sends every journaled write to Sheets in one batchUpdate. If the batch
+    can never succeed, the writes are sent one at a time and the ones which
+    fail are moved to the journal's dead letters.
+    """
+    if self.journal is None:
+      return
+    with self.flush_lock:
+      writes = self.journal.pending()
+      if not writes:
+        return
+      writes = self._check_rows(writes)
+      if not writes:
+        return
+      try:
+        self._send_writes(writes)
+        logger.info(f"Flushed {len(writes)} writes to Google Sheets.")
+        return
+      except Exception as error:
+        if retryable(error):
+          raise
+
+      dropped = set()
+      for write in writes:
+        try:
+          self._send_writes([write])
+        except Exception as error:
+          if retryable(error):
+            raise
+          logger.error(f"Dropping a write to Google Sheets which can't succeed: {write}", exc_info=error)
+          self.journal.bury([write[0]], error)
+          dropped.add(write[2])
+      if dropped:
+        # The cache still has the dropped writes, so reread those sheets. Queue
+        # it rather than wait, since the caller may hold other sheets' locks.
+        self.invalidate.submit(self, *dropped)
+
+  def _check_rows(self, writes: list[tuple[int, str, str, Optional[int], list]]) -> list:
+    """
+    Checks that each update's row still holds its id, since rows may have
+    been moved by hand after it was queued. Updates to moved rows are
+    pointed at the id's new row, or dropped if it's gone.
+    """
+    appended = set()
+    updates = []
+    for write in writes:
+      _, op, sheet, row_number, values = write
+      if op == "append":
+        appended.add((sheet, parse_id(values[0])))
+      elif (sheet, parse_id(values[0])) not in appended:
+        # Rows appended in the same batch aren't in the sheet yet.
+        updates.append(write)
+    if not updates:
+      return writes
+    result = self.quota.execute(self.sheets.values().batchGet(
+        spreadsheetId=self.spreadsheet_id,
+        ranges=[f"'{sheet}'!A{row_number}" for _, _, sheet, row_number, _ in updates],
+        valueRenderOption="UNFORMATTED_VALUE"), "read")
+    moved = set()
+    for (_, _, sheet, _, values), value_range in zip(updates, result.get("valueRanges", [])):
+      cells = value_range.get("values", [])
+      if not (cells and cells[0] and parse_id(cells[0][0]) == parse_id(values[0])):
+        moved.add(sheet)
+    if not moved:
+      return writes
+
+    logger.info(f"Rows were moved by hand in {', '.join(sorted(moved))}, rereading their ids.")
+    ids = {sheet: SheetCache(self._fetch_rows(sheet, ["id"])) for sheet in moved}
+    checked = []
+    for write in writes:
+      id, op, sheet, row_number, values = write
+      if op == "update" and sheet in moved and write in updates:
+        row_number = ids[sheet].row_number(parse_id(values[0]))
+        if row_number is None:
+          error = KeyError(f"No row was found in {sheet} with {values[0]}.")
+          logger.error(f"Dropping a write to Google Sheets whose row is gone: {write}", exc_info=error)
+          self.journal.bury([id], error)
+          continue
+      checked.append((id, op, sheet, row_number, values))
+    # The cache has the old row numbers too. Queue it rather than wait, since
+    # the caller may hold other sheets' locks.
+    self.invalidate.submit(self, *moved)
+    return checked
+
+  def _send_writes(self, writes: list[tuple[int, str, str, Optional[int], list]]):
+    requests = []
+    for _, op, sheet, row_number, values in writes:
+      sheet_id = self._sheet_id(sheet)
+      if op == "update":
+        requests.append(update_row_request(sheet_id, row_number - 1, values))
+      elif requests and requests[-1].get("appendCells", {}).get("sheetId") == sheet_id:
+        # Merge consecutive appends to the same sheet.
+        requests[-1]["appendCells"]["rows"].append(row_data(values))
+      else:
+        requests.append(append_rows_request(sheet_id, [values]))
+    self.quota.execute(self.sheets.batchUpdate(
+        spreadsheetId=self.spreadsheet_id,
+        body={"requests": requests}), "write")
+    self.journal.remove([write[0] for write in writes])
+
+  def _flush_in_background(self):
+    # Nothing interactive waits on the flusher, only reads which flush first.
+    with background():
+      self.flush()
+
+  # Not @threaded since the flusher thread calls this while holding flush_lock.
+  def _sheet_id(self, sheet: str) -> int:
+    """Returns the numeric id of a sheet, which batchUpdate requests use instead of the name."""
+    if sheet not in self.sheet_ids:
+      result = self.quota.execute(self.sheets.get(
+          spreadsheetId=self.spreadsheet_id,
+          fields="sheets.properties(sheetId,title)"), "read")
+      self.sheet_ids = {
+          s["properties"]["title"]: s["properties"]["sheetId"] for s in result["sheets"]}
+    return self.sheet_ids[sheet]
 
   @threaded
-  def _fetch_rows(self, range) -> list[list]:
-    result = self.sheets.values().get(
+  def _fetch_values(self, range: str) -> list[list]:
+    result = self.quota.execute(self.sheets.values().get(
         spreadsheetId=self.spreadsheet_id,
         range=range,
-        valueRenderOption="UNFORMATTED_VALUE").execute()
-    values = result.get("values")
-    if values:
-      restore_ints(values)
-    return values
+        valueRenderOption="UNFORMATTED_VALUE"), "read")
+    return result.get("values", [])
 
   @threaded
-  def get_all(self, sheet: str) -> list[list]:
-    rows = self._fetch_rows(sheet)
-    if not rows:
-      return []
+  def _fetch_rows(self, sheet: str, columns: Optional[list[str]]=None) -> list[Optional[Row]]:
+    if columns:
+      return decode_rows(sheet, self._fetch_values(projected_range(sheet, columns)))
     # Skip the first row since that was a header.
-    return rows[1:]
+    return decode_rows(sheet, self._fetch_values(sheet)[1:])
 
-  @threaded
-  def get(self, sheet: str, user_id: int) -> Optional[list]:
-    rows = self.get_all(sheet)
-    return discord.utils.find(lambda row: row and (row[0] == user_id), rows)
+  def _ingest(self, sheet: str, values: list[list]) -> set[int]:
+    """Adds a tail read to the sheet's index, rebuilding it if the sheet was changed."""
+    index = self.append_only[sheet]
+    if not index.ingest(values):
+      logger.info(f"{sheet} was truncated or edited, rereading its ids.")
+      self.append_only[sheet] = index = AppendOnlyIndex()
+      index.ingest(self._fetch_values(index.tail_range(sheet)))
+    return index.ids
 
-  @threaded
+  @threaded(lane="sheet")
+  def get_all(self, sheet: str, columns: Optional[list[str]]=None) -> list[Optional[Row]]:
+    if columns == ["id"]:
+      return list(self._ids(sheet).rows)
+    if columns and not (self.cache and sheet in self.cache):
+      # Only read the columns needed rather than loading the full cache.
+      return self._fetch_rows(sheet, columns)
+    cache = self._cached(sheet)
+    if cache:
+      return list(cache.rows)
+    return self._fetch_rows(sheet)
+
+  @threaded(lane="sheet")
+  def get(self, sheet: str, user_id: int, columns: Optional[list[str]]=None) -> Optional[Row]:
+    if columns == ["id"]:
+      return self._ids(sheet).get(user_id)
+    cache = self._cached(sheet)
+    if cache:
+      return cache.get(user_id)
+    rows = self.get_all(sheet, columns)
+    return discord.utils.find(lambda row: row and (row.id == user_id), rows)
+
+  @threaded(lane=own_lane)
+  def find_user(self, user_id: int, sheets: list[str], full_rows: Iterable[str]=()) -> list[str]:
+    """Returns the sheets containing the user, reading any uncached ones in one request."""
+    found = {}
+    reads = any(self._find_range(sheet, full_rows) for sheet in sheets)
+    with self._reserved(reads=reads, flush=reads), self._locked(*sheets):
+      # The range to read for each sheet that isn't available locally.
+      ranges = {}
+      for sheet in sheets:
+        range = self._find_range(sheet, full_rows)
+        if range:
+          ranges[sheet] = range
+        elif sheet in self.append_only:
+          found[sheet] = user_id in self.append_only[sheet].ids
+        else:
+          found[sheet] = self._local(sheet).get(user_id) is not None
+
+      if ranges:
+        self.flush()
+        result = self.quota.execute(self.sheets.values().batchGet(
+            spreadsheetId=self.spreadsheet_id,
+            ranges=list(ranges.values()),
+            valueRenderOption="UNFORMATTED_VALUE"), "read")
+        for sheet, value_range in zip(ranges, result.get("valueRanges", [])):
+          values = value_range.get("values", [])
+          if sheet in self.append_only:
+            found[sheet] = user_id in self._ingest(sheet, values)
+            continue
+          if ranges[sheet] == sheet:
+            # Skip the first row since that was a header.
+            self.cache[sheet] = SheetCache(decode_rows(sheet, values[1:]))
+            self.id_cache.pop(sheet, None)
+            found[sheet] = self.cache[sheet].get(user_id) is not None
+            continue
+          ids = SheetCache(decode_rows(sheet, values))
+          if self.id_cache is not None and not self._local(sheet):
+            self.id_cache[sheet] = ids
+          found[sheet] = ids.get(user_id) is not None
+
+    return [sheet for sheet in sheets if found[sheet]]
+
+  def _find_range(self, sheet: str, full_rows: Iterable[str]) -> Optional[str]:
+    """Returns the range find_user() has to read for the sheet, or None if it's available locally."""
+    if sheet in self.append_only:
+      index = self.append_only[sheet]
+      if index.stale or self.cache is None:
+        return index.tail_range(sheet)
+      return None
+    if self.cache is not None and sheet in full_rows and sheet not in self.cache:
+      return sheet
+    if self._local_ids(sheet):
+      return None
+    return projected_range(sheet, ["id"])
+
+  @threaded(lane=own_lane)
+  def poll_changes(self, sheets: list[str]) -> list[str]:
+    """
+    Returns the sheets that were changed outside the bot since the last poll,
+    reloading them into the cache.
+
+    Only the id columns are read, in one request, which catches rows being
+    added, removed or reordered. Cached sheets whose ids changed are then
+    reread in full in a second request. Edits to other cells are left for
+    `invalidate()`. The same request reads the tail of each append-only
+    sheet, so rows added to them by hand are counted too.
+    """
+    changed = []
+    tails = []
+    if self.cache is not None:
+      # Uncached sheets will be read fresh anyway.
+      sheets = [sheet for sheet in sheets if self._local(sheet)]
+      # Stale indexes are read on their next use anyway.
+      tails = [sheet for sheet, index in self.append_only.items() if not index.stale and sheet not in sheets]
+    if not sheets and not tails:
+      return changed
+    reload = []
+    with self._reserved(reads=1, flush=True), self._locked(*sheets, *tails):
+      # Queued writes would otherwise look like manual edits.
+      self.flush()
+      ranges = [projected_range(sheet, ["id"]) for sheet in sheets]
+      ranges += [self.append_only[sheet].tail_range(sheet) for sheet in tails]
+      result = self.quota.execute(self.sheets.values().batchGet(
+          spreadsheetId=self.spreadsheet_id,
+          ranges=ranges,
+          valueRenderOption="UNFORMATTED_VALUE"), "read")
+      value_ranges = result.get("valueRanges", [])
+      for sheet, value_range in zip(tails, value_ranges[len(sheets):]):
+        self._ingest(sheet, value_range.get("values", []))
+      for sheet, value_range in zip(sheets, value_ranges):
+        ids = decode_rows(sheet, value_range.get("values", []))
+        if self.cache is None:
+          if sheet in self.polled and self.polled[sheet] != id_column(ids):
+            changed.append(sheet)
+          self.polled[sheet] = id_column(ids)
+        elif sheet in self.cache:
+          # The bot's own writes already updated the cache, so any difference
+          # is a manual edit. Sheets loaded from a snapshot are checked in full.
+          if sheet in self.unreconciled or id_column(self.cache[sheet].rows) != id_column(ids):
+            reload.append(sheet)
+        else:
+          # Nothing was rendered from just the ids, so only keep them current.
+          self.id_cache[sheet] = SheetCache(ids)
+    if not reload:
+      return changed
+
+    # Take the second read's token without holding the locks.
+    with self._reserved(reads=1, flush=True), self._locked(*reload):
+      # Writes made since the locks were released have to reach Sheets first.
+      self.flush()
+      reload = [sheet for sheet in reload if sheet in self.cache]
+      if not reload:
+        return changed
+      result = self.quota.execute(self.sheets.values().batchGet(
+          spreadsheetId=self.spreadsheet_id,
+          ranges=reload,
+          valueRenderOption="UNFORMATTED_VALUE"), "read")
+      for sheet, value_range in zip(reload, result.get("valueRanges", [])):
+        # Skip the first row since that was a header.
+        rows = decode_rows(sheet, value_range.get("values", [])[1:])
+        if self.cache[sheet].rows != rows:
+          if sheet in self.unreconciled:
+            logger.info(f"{sheet} changed since the snapshot was saved.")
+          self.cache[sheet] = SheetCache(rows)
+          changed.append(sheet)
+        self.unreconciled.discard(sheet)
+    return changed
+
+  @threaded(lane=own_lane)
+  def warm_up(self, sheets: list[str]):
+    """Builds the service and reads any of the sheets that aren't cached in one request."""
+    start = time.perf_counter()
+    if self.cache is None:
+      self.sheets
+      return
+    reads = any(
+        self.append_only[sheet].stale if sheet in self.append_only else sheet not in self.cache for sheet in sheets)
+    with self._reserved(reads=reads, flush=reads), self._locked(*sheets):
+      ranges = {}
+      for sheet in sheets:
+        if sheet in self.append_only:
+          if self.append_only[sheet].stale:
+            ranges[sheet] = self.append_only[sheet].tail_range(sheet)
+        elif sheet not in self.cache:
+          ranges[sheet] = sheet
+      if not ranges:
+        return
+      self.flush()
+      result = self.quota.execute(self.sheets.values().batchGet(
+          spreadsheetId=self.spreadsheet_id,
+          ranges=list(ranges.values()),
+          valueRenderOption="UNFORMATTED_VALUE"), "read")
+      for sheet, value_range in zip(ranges, result.get("valueRanges", [])):
+        values = value_range.get("values", [])
+        if sheet in self.append_only:
+          self._ingest(sheet, values)
+        else:
+          # Skip the first row since that was a header.
+          self.cache[sheet] = SheetCache(decode_rows(sheet, values[1:]))
+          self.id_cache.pop(sheet, None)
+    logger.info(f"Warmed up {', '.join(ranges)} in {time.perf_counter() - start:.2f}s.")
+
+  @threaded(lane="sheet")
   def append(self, sheet: str, values: list):
-    result = self.sheets.values().append(
-        spreadsheetId=self.spreadsheet_id,
-        range=sheet,
-        valueInputOption="RAW",
-        body=value_list(values)).execute()
+    with self._reserved(writes=self.journal is None), self._locked(sheet):
+      if sheet in self.append_only:
+        # The next tail read will count the row itself.
+        self.append_only[sheet].ids.add(decode(sheet, values).id)
+      local = self._local(sheet)
+      if self.journal is not None:
+        self.journal.push("append", sheet, None, values)
+        if local:
+          local.append(decode(sheet, values))
+        self.flusher.wake()
+        return None
+      result = self.quota.execute(self.sheets.values().append(
+          spreadsheetId=self.spreadsheet_id,
+          range=sheet,
+          valueInputOption="RAW",
+          body=value_list(values)), "write")
+      if local:
+        updated_range = result.get("updates", {}).get("updatedRange", "")
+        # Rows loaded from a snapshot may not line up with the sheet yet.
+        row_number = None if sheet in self.unreconciled else range_row(updated_range)
+        local.append(decode(sheet, values), row_number)
     return result
 
-  @threaded
+  @threaded(lane="sheet")
   def update(self, sheet: str, values: list):
     if not values:
       raise ValueError("Must have at least one value (user_id) for an update.")
 
-    rows = self.get_all(sheet)
-    if not rows:
-      return None
-    # Find the row number.
-    # Enumerate starting at 2 since the rows are 1-indexed and the first row
-    # is the header, which get_all() doesn't return.
-    numbered_rows = enumerate(rows, 2)
-    print("\n".join(map(str, rows)))
-    data = discord.utils.find(lambda row: row and (row[1][0] == values[0]), numbered_rows)
-    if not data:
-      raise KeyError(f"No row was found in {sheet} with {values[0]}.")
-    i = data[0]
-
-    result = self.sheets.values().update(
-        spreadsheetId=self.spreadsheet_id,
-        range=f"{sheet}!{i}:{i}",
-        valueInputOption="RAW",
-        body=value_list(values)).execute()
+    try:
+      return self._update(sheet, values)
+    except KeyError:
+      if self.cache is None:
+        raise
+    # A miss or a moved row means the index is stale from a manual edit, so reread once.
+    # The locks were released so the reread can wait for quota without them.
+    self.invalidate(sheet)
+    return self._update(sheet, values)
+
+  def _update(self, sheet: str, values: list):
+    reads = not self._local_ids(sheet)
+    # Cached row numbers are checked first, unless flush() checks them.
+    check = self.journal is None and not reads
+    with self._reserved(reads=reads + check, writes=self.journal is None, flush=reads), self._locked(sheet):
+      check = self.journal is None and self._local_ids(sheet) is not None
+      cache = self._ids(sheet)
+      i = cache.row_number(values[0])
+      if i is None:
+        raise KeyError(f"No row was found in {sheet} with {values[0]}.")
+      if check:
+        cells = self._fetch_values(f"'{sheet}'!A{i}")
+        if not (cells and cells[0] and parse_id(cells[0][0]) == parse_id(values[0])):
+          logger.info(f"Row {i} of {sheet} no longer holds {values[0]}, rereading its ids.")
+          raise KeyError(f"Row {i} of {sheet} no longer holds {values[0]}.")
+
+      if self.journal is not None:
+        # Appends only add rows at the end and deletes flush first, so only
+        # rows moved by hand can change the row number, which flush() checks.
+        self.journal.push("update", sheet, i, values)
+        local = self._local(sheet)
+        if local:
+          local.update(decode(sheet, values))
+        self.flusher.wake()
+        return None
+
+      result = self.quota.execute(self.sheets.values().update(
+          spreadsheetId=self.spreadsheet_id,
+          range=f"{sheet}!{i}:{i}",
+          valueInputOption="RAW",
+          body=value_list(values)), "write")
+      local = self._local(sheet)
+      if local:
+        local.update(decode(sheet, values))
     return result
 
-  @threaded
-  def delete(self, sheet: str, *user_ids: int):
-    """Deletes rows matching the user_ids by overwriting them"""
-    rows = self.get_all(sheet)
-    new_rows = list(filter(lambda row: (not row) or (row[0] not in user_ids), rows))
-
-    num_clears = len(rows) - len(new_rows)
-    # Sheets doesn't like empty updates.
-    if num_clears == 0:
-      return None
-    # Pad with empty rows so the table gets cleared out.
-    for _ in range(num_clears):
-      new_rows.append([""]*5)
+  @threaded(lane="sheet")
+  def delete(self, sheet: str, *user_ids: int) -> list[int]:
+    """
+    Deletes the rows matching the user_ids, shifting the rows below them up.
+    Returns the ids which were found.
+    """
+    with self._reserved(
+        reads=not self._local_ids(sheet), writes=1, sheet_ids=[sheet], flush=True), self._locked(sheet):
+      self.flush()
+      rows = self._ids(sheet).rows
+      # Add 1 to get the 0-based sheet index since the rows skip the header.
+      indices = [i + 1 for i, row in enumerate(rows) if row and row.id in user_ids]
+      # Sheets doesn't like empty updates.
+      if not indices:
+        return []
+      found = {rows[i - 1].id for i in indices}
 
-    result = self.sheets.values().update(
-        spreadsheetId=self.spreadsheet_id,
-        range=f"{sheet}!2:{2+len(new_rows)}",
-        valueInputOption="RAW",
-        body=value_multi_list(new_rows)).execute()
+      # Delete from the bottom up so the earlier indices stay valid.
+      sheet_id = self._sheet_id(sheet)
+      requests = [delete_row_request(sheet_id, i) for i in reversed(indices)]
+      self.quota.execute(self.sheets.batchUpdate(
+          spreadsheetId=self.spreadsheet_id,
+          body={"requests": requests}), "write")
+      local = self._local(sheet)
+      if local:
+        local.delete(user_ids)
+      if sheet in self.append_only:
+        self.append_only[sheet] = AppendOnlyIndex()
+    return [user_id for user_id in user_ids if user_id in found]
+
+  @threaded(lane=own_lane)
+  def move(self, user_id: int, src_sheets: list[str], dst_sheet: str, values: list):
+    """
+    Appends values to dst_sheet and deletes the user's rows from src_sheets.
+
+    Everything is sent in one batchUpdate, which Sheets applies atomically.
+    """
+    reads = sum(not self._local_ids(sheet) for sheet in src_sheets)
+    with self._reserved(
+        reads=reads, writes=1, sheet_ids=[dst_sheet, *src_sheets], flush=True), self._locked(dst_sheet, *src_sheets):
+      self.flush()
+      requests = [append_rows_request(self._sheet_id(dst_sheet), [values])]
+      for sheet in src_sheets:
+        rows = self._ids(sheet).rows
+        # Delete from the bottom up so the earlier indices stay valid.
+        sheet_id = self._sheet_id(sheet)
+        for i in reversed(range(len(rows))):
+          if rows[i] and rows[i].id == user_id:
+            requests.append(delete_row_request(sheet_id, i + 1))
+
+      result = self.quota.execute(self.sheets.batchUpdate(
+          spreadsheetId=self.spreadsheet_id,
+          body={"requests": requests}), "write")
+      local = self._local(dst_sheet)
+      if local:
+        local.append(decode(dst_sheet, values))
+      for sheet in src_sheets:
+        local = self._local(sheet)
+        if local:
+          local.delete((user_id,))
+      if dst_sheet in self.append_only:
+        self.append_only[dst_sheet].ids.add(decode(dst_sheet, values).id)
+      for sheet in src_sheets:
+        if sheet in self.append_only:
+          self.append_only[sheet] = AppendOnlyIndex()
     return result
 
 
@@ -0,0 +1,59 @@
+"""A module for saving cached sheet state to disk so a restart can serve it right away.
+
+Usage:
+  snapshot.save("sheets.snapshot", {"Requests": {"rows": [[1234, "name", "2024-01-01T00:00:00"]]}})
+  entries = snapshot.load("sheets.snapshot")  # {} if there's no snapshot yet.
+
+  Each entry is stored with a SHA-256 hash of its content. Entries whose
+  hash doesn't match, e.g. from a damaged or hand-edited file, are left out
+  when loading so they're read from Sheets instead. Files are replaced
+  atomically, so a crash mid-save leaves the previous snapshot.
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content) -> str:
+  """Returns a SHA-256 hex digest of JSON-serializable content."""
+  return hashlib.sha256(json.dumps(content, separators=(",", ":"), sort_keys=True).encode()).hexdigest()
+
+
+def save(path: str, entries: dict):
+  data = {
+      "saved": time.time(),
+      "entries": {name: {"hash": content_hash(entry), "content": entry} for name, entry in entries.items()},
+      }
+  temp_path = f"{path}.tmp"
+  with open(temp_path, "w") as snapshot_file:
+    json.dump(data, snapshot_file, separators=(",", ":"))
+  os.replace(temp_path, path)
+
+
+def load(path: str) -> dict:
+  """Returns the entries of the snapshot at path which still match their hashes."""
+  try:
+    with open(path) as snapshot_file:
+      data = json.load(snapshot_file)
+  except FileNotFoundError:
+    return {}
+  except (OSError, ValueError) as error:
+    logger.warning(f"Unable to read the snapshot at {path}.", exc_info=error)
+    return {}
+
+  entries = {}
+  for name, entry in data.get("entries", {}).items():
+    if content_hash(entry["content"]) != entry["hash"]:
+      logger.warning(f"Ignoring {name} in the snapshot since it doesn't match its hash.")
+      continue
+    entries[name] = entry["content"]
+  age = time.time() - data.get("saved", 0)
+  logger.info(f"Loaded {', '.join(entries) or 'nothing'} from a snapshot saved {age:.0f}s ago.")
+  return entries
@@ -0,0 +1,198 @@
+import json
+import logging
+import sqlite3
+
+
+from contextlib import contextmanager
+from quota import background
+from records import Row, decode, decode_rows
+from sheets_orm import SheetsWrapper, StorageBackend
+from typing import Iterable, Optional
+from threaded import AsyncFacade, threaded
+from write_behind import FlushThread, WriteJournal, retryable
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteBackend(StorageBackend):
+  """
+  A storage backend which keeps the lists in a local SQLite database.
+
+  Reads never touch the network. With a `mirror`, each sheet is imported from
+  Google Sheets the first time it's used, and each write is queued for the
+  mirror in the same transaction as the local change, then replicated in
+  the background, in order. Writes which fail are retried until they
+  succeed or fail in a way they always will, when they're moved to the dead
+  letters. Manual edits to the spreadsheet are pulled in by `invalidate()`,
+  e.g. from the /refresh commands. While writes are still queued, the local
+  rows are served instead, and the sheets are imported again once the queue
+  drains, so the import doesn't overwrite them.
+
+  All calls run in order on this backend's own lane, which also keeps the
+  connection to one thread at a time. Local reads are cheap, so `columns`
+  is ignored and full rows are always returned.
+  """
+  @threaded(lane="self")
+  def __init__(self, path: str, mirror: Optional[SheetsWrapper]=None):
+    self.mirror = mirror
+    # Sheets to import again on their next use.
+    self.stale: set[str] = set()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    # Writes for the mirror, as (method, args) calls, which survive a restart.
+    # The replicator shares the connection, so transactions hold its lock.
+    self.journal = WriteJournal(db=self.db)
+    with self._transaction():
+      self.db.execute(
+          "CREATE TABLE IF NOT EXISTS rows ("
+          "id INTEGER PRIMARY KEY, sheet TEXT NOT NULL, user_id, data TEXT NOT NULL)")
+      self.db.execute("CREATE INDEX IF NOT EXISTS rows_user_id ON rows (sheet, user_id)")
+      self.db.execute("CREATE TABLE IF NOT EXISTS imported (sheet TEXT PRIMARY KEY)")
+    self.imported = {sheet for (sheet,) in self.db.execute("SELECT sheet FROM imported")}
+    self.async_ = AsyncFacade(self)
+    if mirror:
+      self.replicator = FlushThread(self._replicate_in_background)
+      self.replicator.start()
+      # Replay anything left over from the last run.
+      self.replicator.wake()
+
+  @threaded(lane="self")
+  def invalidate(self, *sheets: str):
+    """Marks the sheets to be imported from the mirror again on their next use."""
+    if not self.mirror:
+      return
+    self.stale.update(sheets or self.imported)
+
+  @contextmanager
+  def _transaction(self):
+    """Commits the block's changes together with the mirror writes it queues."""
+    with self.journal.lock, self.db:
+      yield
+
+  def _import(self, *sheets: str):
+    """Copies the sheets from the mirror if they haven't been imported yet or are stale."""
+    if not self.mirror:
+      return
+    for sheet in sheets:
+      if sheet in self.imported and sheet not in self.stale:
+        continue
+      if sheet in self.imported and len(self.journal):
+        # Importing now would lose the queued writes, so the replicator
+        # imports the sheet once they've reached the mirror.
+        self.replicator.wake()
+        continue
+      self.mirror.invalidate(sheet)
+      rows = self.mirror.get_all(sheet)
+      with self._transaction():
+        self.db.execute("DELETE FROM rows WHERE sheet = ?", (sheet,))
+        self.db.executemany(
+            "INSERT INTO rows (sheet, user_id, data) VALUES (?, ?, ?)",
+            [(sheet, row.id, json.dumps(row.values())) for row in rows if row])
+        self.db.execute("INSERT OR IGNORE INTO imported (sheet) VALUES (?)", (sheet,))
+      self.imported.add(sheet)
+      self.stale.discard(sheet)
+
+  def _queue(self, method: str, sheet: str, *args):
+    """Queues a call to the mirror in the caller's transaction, to be sent once it commits."""
+    if not self.mirror:
+      return
+    self.journal.queue(method, sheet, None, list(args))
+    # The replicator waits on the journal lock, so it won't see this before the commit.
+    self.replicator.wake()
+
+  def _replicate(self):
+    """
+    Sends the queued writes to the mirror in order. Raises on the first one
+    which might succeed later, leaving it and the rest queued.
+    """
+    for id, method, sheet, _, args in self.journal.pending():
+      try:
+        getattr(self.mirror, method)(*args)
+      except Exception as error:
+        if retryable(error):
+          raise
+        logger.error(f"Dropping a write to Google Sheets which can't succeed: {method}{tuple(args)}", exc_info=error)
+        self.journal.bury([id], error)
+        continue
+      self.journal.remove([id])
+
+  def _replicate_in_background(self):
+    with background():
+      self._replicate()
+      if self.stale:
+        # Import the sheets which were left stale while writes were queued.
+        self.warm_up.submit(self, sorted(self.stale))
+
+  @threaded(lane="self")
+  def get_all(self, sheet: str, columns: Optional[list[str]]=None) -> list[Row]:
+    self._import(sheet)
+    cursor = self.db.execute("SELECT data FROM rows WHERE sheet = ? ORDER BY id", (sheet,))
+    return decode_rows(sheet, [json.loads(data) for (data,) in cursor])
+
+  @threaded(lane="self")
+  def get(self, sheet: str, user_id: int, columns: Optional[list[str]]=None) -> Optional[Row]:
+    self._import(sheet)
+    row = self.db.execute(
+        "SELECT data FROM rows WHERE sheet = ? AND user_id = ? ORDER BY id LIMIT 1",
+        (sheet, user_id)).fetchone()
+    return decode_rows(sheet, [json.loads(row[0])])[0] if row else None
+
+  @threaded(lane="self")
+  def find_user(self, user_id: int, sheets: list[str], full_rows: Iterable[str]=()) -> list[str]:
+    self._import(*sheets)
+    found = {sheet for (sheet,) in self.db.execute(
+        f"SELECT DISTINCT sheet FROM rows WHERE user_id = ? AND sheet IN ({','.join('?' * len(sheets))})",
+        (user_id, *sheets))}
+    return [sheet for sheet in sheets if sheet in found]
+
+  @threaded(lane="self")
+  def warm_up(self, sheets: list[str]):
+    self._import(*sheets)
+
+  @threaded(lane="self")
+  def append(self, sheet: str, values: list):
+    self._import(sheet)
+    row = decode(sheet, values)
+    with self._transaction():
+      self.db.execute(
+          "INSERT INTO rows (sheet, user_id, data) VALUES (?, ?, ?)", (sheet, row.id, json.dumps(row.values())))
+      self._queue("append", sheet, sheet, values)
+
+  @threaded(lane="self")
+  def update(self, sheet: str, values: list):
+    if not values:
+      raise ValueError("Must have at least one value (user_id) for an update.")
+    self._import(sheet)
+    row = decode(sheet, values)
+    with self._transaction():
+      cursor = self.db.execute(
+          "UPDATE rows SET data = ? WHERE id = "
+          "(SELECT id FROM rows WHERE sheet = ? AND user_id = ? ORDER BY id LIMIT 1)",
+          (json.dumps(row.values()), sheet, row.id))
+      if cursor.rowcount == 0:
+        raise KeyError(f"No row was found in {sheet} with {values[0]}.")
+      self._queue("update", sheet, sheet, values)
+
+  @threaded(lane="self")
+  def delete(self, sheet: str, *user_ids: int) -> list[int]:
+    self._import(sheet)
+    found = []
+    with self._transaction():
+      for user_id in user_ids:
+        cursor = self.db.execute("DELETE FROM rows WHERE sheet = ? AND user_id = ?", (sheet, user_id))
+        if cursor.rowcount:
+          found.append(user_id)
+      if found:
+        self._queue("delete", sheet, sheet, *found)
+    return found
+
+  @threaded(lane="self")
+  def move(self, user_id: int, src_sheets: list[str], dst_sheet: str, values: list):
+    self._import(dst_sheet, *src_sheets)
+    row = decode(dst_sheet, values)
+    with self._transaction():
+      self.db.executemany(
+          "DELETE FROM rows WHERE sheet = ? AND user_id = ?", [(sheet, user_id) for sheet in src_sheets])
+      self.db.execute(
+          "INSERT INTO rows (sheet, user_id, data) VALUES (?, ?, ?)", (dst_sheet, row.id, json.dumps(row.values())))
+      self._queue("move", dst_sheet, user_id, src_sheets, dst_sheet, values)
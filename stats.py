@@ -0,0 +1,97 @@
+import discord
+import logging
+import metrics
+
+
+from discord import app_commands
+from discord.ext import commands, tasks
+from global_config import GUILD_ID
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+metrics_write_interval = 15 # Seconds.
+
+
+def record_command(itx: discord.Interaction, error: Optional[Exception]=None):
+  """Records how long Discord's user waited on a command, from the interaction's creation."""
+  name = itx.command.qualified_name if itx.command else "unknown"
+  latency = (discord.utils.utcnow() - itx.created_at).total_seconds()
+  metrics.observe("command_seconds", latency, command=name)
+  if error:
+    metrics.count("command_errors_total", command=name)
+
+
+def summarize(histograms: dict, counters: dict, name: str, label: str, errors: Optional[str]=None) -> str:
+  """Returns a line per label value of the histogram with its call count and percentiles."""
+  lines = []
+  for (metric, labels), histogram in sorted(histograms.items()):
+    if metric != name:
+      continue
+    line = (
+        f"`{dict(labels).get(label)}` {histogram.count} calls, p50 ≤{histogram.quantile(0.5)}s, "
+        f"p95 ≤{histogram.quantile(0.95)}s")
+    if errors:
+      line += f", {int(counters.get((errors, labels), 0))} errors"
+    lines.append(line)
+  # Embed fields are limited to 1024 characters.
+  return ("\n".join(lines) or "None yet.")[:1024]
+
+
+class StatsCog(commands.Cog):
+  """
+  A cog which records command latency and reports the bot's metrics.
+
+  With a `metrics_path`, the metrics are also written there in the
+  Prometheus text format for a node_exporter textfile collector.
+  """
+  def __init__(self, metrics_path: Optional[str]=None):
+    self.metrics_path = metrics_path
+
+  async def cog_load(self):
+    logger.info("StatsCog loaded.")
+    if self.metrics_path:
+      self.write_loop.start()
+
+  async def cog_unload(self):
+    self.write_loop.cancel()
+
+  @commands.Cog.listener()
+  async def on_app_command_completion(self, itx: discord.Interaction, command):
+    record_command(itx)
+
+  @tasks.loop(seconds=metrics_write_interval)
+  async def write_loop(self):
+    try:
+      metrics.write(self.metrics_path)
+    except OSError as error:
+      logger.warning(f"Unable to write metrics to {self.metrics_path}.", exc_info=error)
+
+  @app_commands.command()
+  @app_commands.guilds(GUILD_ID)
+  @app_commands.default_permissions(administrator=True)
+  async def stats(self, itx: discord.Interaction):
+    """Shows command latency, Sheets calls and queueing since the bot started."""
+    histograms, counters, gauges = metrics.snapshot()
+    gauges = {(name, dict(labels).get("kind")): value for (name, labels), value in gauges.items()}
+    embed = discord.Embed(title="Stats")
+    embed.colour = discord.Colour.purple()
+    embed.add_field(
+        name="Commands", inline=False,
+        value=summarize(histograms, counters, "command_seconds", "command", "command_errors_total"))
+    embed.add_field(
+        name="Sheets requests", inline=False,
+        value=summarize(histograms, counters, "sheets_request_seconds", "method", "sheets_request_errors_total"))
+    embed.add_field(
+        name="Executor", inline=False,
+        value=(
+          f"{gauges.get(('executor_queued_calls', None), 0)} calls queued on "
+          f"{gauges.get(('executor_busy_lanes', None), 0)} busy lanes\n"
+          + summarize(histograms, counters, "executor_wait_seconds", "function")))
+    embed.add_field(
+        name="Sheets quota", inline=False,
+        value="\n".join(
+          f"`{kind}` {gauges.get(('sheets_quota_remaining', kind), 0)} left this minute, "
+          f"{gauges.get(('sheets_quota_queued', kind), 0)} queued"
+          for kind in ("read", "write")))
+    await itx.response.send_message(embed=embed, ephemeral=True)
@@ -1,4 +1,4 @@
-"""A module for running methods in a single thread.
+"""A module for running methods on a small pool of threads in ordered lanes.
 
 Usage:
   class Adder:
@@ -11,32 +11,141 @@ Usage:
       return self.add(a, b) + 10
 
   This ensures that when add() is called on its own, it's scheduled on the
-  module's thread, but when it's called by add_plus_ten(), it isn't
+  module's threads, but when it's called by add_plus_ten(), it isn't
   re-scheduled, creating a deadlock.
 
+Lanes:
+  class Sheets:
+    @threaded(lane="sheet")
+    def append(self, sheet, values):
+      ...
+
+  Calls are queued on a lane keyed by the value of the named argument. Calls
+  on the same lane run one at a time in the order they were made, while
+  different lanes run in parallel on the pool. Calls without a lane share
+  the default lane, while `lane=own_lane` gives each call a lane of its own,
+  e.g. for calls which are ordered by locks instead. Queued calls run in a
+  copy of the caller's context, so context variables, e.g. the priority and
+  trace, follow them onto the pool.
+
+Async:
+  adder = Adder()
+  total = await AsyncFacade(adder).add(1, 2)
+
+  From the event loop, AsyncFacade queues the call on its lane and awaits the
+  future directly rather than blocking another thread on the result.
 """
 
 
+import asyncio
+import contextvars
+import inspect
+import metrics
 import threading
+import time
+import tracing
 
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
 
 
-executor = ThreadPoolExecutor(max_workers=1)
+max_workers = 4
+
+
 # Create global thread-local data. This will be checked by @threaded in order
 # to determine whether or not we're already in the executor.
 thread_local = threading.local()
 def __init_thread_local():
   thread_local.thread_id = threading.get_ident()
-executor.submit(__init_thread_local).result()
+executor = ThreadPoolExecutor(max_workers=max_workers, initializer=__init_thread_local)
+
+# Pending calls for each lane. A lane's queue keeps its running call at the
+# front, so a lane with a non-empty queue already has a worker draining it.
+lanes: dict = {}
+lanes_lock = threading.Lock()
+
+# A lane for @threaded which runs each call on a new lane.
+own_lane = object()
+
+
+def _queued_calls() -> int:
+  with lanes_lock:
+    # Each lane's running call is at the front of its queue.
+    return sum(len(queue) for queue in lanes.values()) - len(lanes)
+metrics.gauge("executor_queued_calls", _queued_calls)
+metrics.gauge("executor_busy_lanes", lambda: len(lanes))
+
+
+def _drain(lane):
+  while True:
+    with lanes_lock:
+      future, context, submitted, f, args, kwargs = lanes[lane][0]
+    if future.set_running_or_notify_cancel():
+      metrics.observe("executor_wait_seconds", time.perf_counter() - submitted, function=f.__qualname__)
+      try:
+        with metrics.timed("executor_run_seconds", function=f.__qualname__):
+          future.set_result(context.run(_traced, submitted, f, args, kwargs))
+      except BaseException as error:
+        future.set_exception(error)
+    with lanes_lock:
+      queue = lanes[lane]
+      queue.popleft()
+      if not queue:
+        del lanes[lane]
+        return
 
 
-def threaded(f):
+def _traced(submitted: float, f, args, kwargs):
+  with tracing.span(f.__qualname__, submitted=submitted):
+    return f(*args, **kwargs)
+
+
+def submit(lane, f, *args, **kwargs) -> Future:
+  """Queues f on the lane and returns a future for its result."""
+  future = Future()
+  with lanes_lock:
+    queue = lanes.setdefault(lane, deque())
+    queue.append((future, contextvars.copy_context(), time.perf_counter(), f, args, kwargs))
+    if len(queue) == 1:
+      executor.submit(_drain, lane)
+  return future
+
+
+def threaded(f=None, *, lane: str=None):
+  if f is None:
+    return lambda f: threaded(f, lane=lane)
+
+  lane_index = list(inspect.signature(f).parameters).index(lane) if isinstance(lane, str) else None
+  def lane_key(args, kwargs):
+    if lane is own_lane:
+      return object()
+    if lane is None:
+      return None
+    if lane in kwargs:
+      return kwargs[lane]
+    if lane_index < len(args):
+      return args[lane_index]
+    return None
+
   @wraps(f)
   def wrapper(*args, **kwargs):
     if "thread_id" not in thread_local.__dict__:
-      return executor.submit(f, *args, **kwargs).result()
+      return submit(lane_key(args, kwargs), f, *args, **kwargs).result()
     return f(*args, **kwargs)
+  wrapper.submit = lambda *args, **kwargs: submit(lane_key(args, kwargs), f, *args, **kwargs)
   return wrapper
+
+
+class AsyncFacade:
+  """Exposes the @threaded methods of an object as coroutines for the event loop."""
+  def __init__(self, obj):
+    self._obj = obj
+
+  def __getattr__(self, name):
+    method = getattr(self._obj, name)
+    if not hasattr(method, "submit"):
+      raise AttributeError(f"{name} is not a @threaded method.")
+    # The submit attribute comes from the function, so self isn't bound.
+    return lambda *args, **kwargs: asyncio.wrap_future(method.submit(self._obj, *args, **kwargs))
@@ -0,0 +1,137 @@
+"""A module for tracing where the time goes while handling an interaction.
+
+Usage:
+  tracing.enable("slow_interactions.jsonl")
+  tree.interaction_check = tracing.begin_interaction
+  ...
+  with tracing.span("sheets values.get", submitted=queued_at):
+    ...
+  tracing.end_interaction(itx)
+
+  The current span is a context variable, so it follows work through
+  `threaded.submit()` onto the pool and into tasks created by a command.
+  Each span records when it was submitted, when it started and when it
+  ended, which separates time spent queueing from time spent working.
+  Interactions slower than `slow_interaction_seconds` are written to the
+  log file as one JSON object per line. Spans outside an interaction, or
+  while tracing is disabled, cost a context variable lookup.
+"""
+
+
+import discord
+import json
+import logging
+import threading
+import time
+
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+# Discord shows an error if an interaction isn't answered within 3 seconds.
+slow_interaction_seconds = 3
+
+enabled = False
+log_path: Optional[str] = None
+log_lock = threading.Lock()
+
+
+class Trace:
+  def __init__(self, itx: discord.Interaction):
+    self.itx = itx
+    self.command = itx.command.qualified_name if itx.command else "unknown"
+    # Interactions are created by Discord, so the trace starts then.
+    self.received = time.perf_counter()
+    self.start = self.received - (discord.utils.utcnow() - itx.created_at).total_seconds()
+    self.spans: list[Span] = []
+    self.finished = False
+
+
+class Span:
+  def __init__(self, trace: Trace, name: str, parent: Optional["Span"], submitted: float):
+    self.trace = trace
+    self.id = len(trace.spans)
+    self.name = name
+    self.parent = parent
+    self.submitted = submitted
+    self.started = time.perf_counter()
+    self.ended: Optional[float] = None
+
+  def to_dict(self) -> dict:
+    def ms(t: Optional[float]) -> Optional[float]:
+      return None if t is None else round((t - self.trace.start) * 1000, 1)
+    return {
+        "id": self.id,
+        "name": self.name,
+        "parent": self.parent.id if self.parent else None,
+        "submitted_ms": ms(self.submitted),
+        "started_ms": ms(self.started),
+        "ended_ms": ms(self.ended),
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def enable(path: str):
+  """Turns tracing on, writing slow interactions to the file at path."""
+  global enabled, log_path
+  enabled = True
+  log_path = path
+
+
+async def begin_interaction(itx: discord.Interaction) -> bool:
+  """Starts a trace for the interaction. Fits CommandTree.interaction_check, so it returns True."""
+  if enabled:
+    current_trace.set(Trace(itx))
+    current_span.set(None)
+  return True
+
+
+@contextmanager
+def span(name: str, submitted: Optional[float]=None):
+  """Records the block as a span of the current trace, if there is one."""
+  trace = current_trace.get()
+  if not trace or trace.finished:
+    yield
+    return
+  new_span = Span(trace, name, current_span.get(), submitted or time.perf_counter())
+  trace.spans.append(new_span)
+  token = current_span.set(new_span)
+  try:
+    yield
+  finally:
+    new_span.ended = time.perf_counter()
+    current_span.reset(token)
+
+
+def end_interaction(itx: discord.Interaction, error: Optional[Exception]=None):
+  """Finishes the interaction's trace and writes it out if it was slow."""
+  trace = current_trace.get()
+  if not trace or trace.itx is not itx or trace.finished:
+    return
+  trace.finished = True
+  total = time.perf_counter() - trace.start
+  if total < slow_interaction_seconds:
+    return
+  logger.warning(f"Slow interaction: /{trace.command} took {total:.1f}s.")
+  record = {
+      "time": itx.created_at.isoformat(),
+      "interaction": itx.id,
+      "command": trace.command,
+      "user": itx.user.id,
+      "total_ms": round(total * 1000, 1),
+      # Time for the interaction to reach the bot and get through the event loop.
+      "received_ms": round((trace.received - trace.start) * 1000, 1),
+      "error": repr(error) if error else None,
+      "spans": [s.to_dict() for s in trace.spans],
+      }
+  try:
+    with log_lock, open(log_path, "a") as log_file:
+      log_file.write(json.dumps(record) + "\n")
+  except OSError as error:
+    logger.warning(f"Unable to write trace to {log_path}.", exc_info=error)
@@ -1,19 +1,30 @@
 import asyncio
 import discord
+import hashlib
+import json
 import logging
 import traceback
 
 from config import ConfigWrapper
-from datetime import datetime
+from datetime import datetime, timedelta
 from discord import app_commands, ui
 from discord.ext import commands, tasks
+from contextlib import nullcontext
+from expiry import ExpiryQueue
 from global_config import GUILD_ID
-from sheets_orm import SheetsWrapper
+from quota import background, in_background
+from records import Row
+from refresh import RefreshScheduler
+from sheets_orm import StorageBackend
 from typing import Optional
 
 
 logger = logging.getLogger(__name__)
-autoremoval_loop_interval = 10 * 60 # Seconds.
+# How often the requests sheet is reread to catch manual edits. Expiry itself
+# is scheduled for each user's deadline.
+autoremoval_loop_interval = 60 * 60 # Seconds.
+# The number of autoremoval DMs sent at once.
+autoremoval_dm_concurrency = 5
 
 
 class ConfirmationView(ui.View):
@@ -59,31 +70,49 @@ def sheet_time():
   return datetime.today().isoformat()
 
 
-def get_mentions(user_rows: list, guild: discord.Guild) -> str:
-  mention_list = []
-  for values in user_rows:
-    # TODO: Better handle empty rows.
-    if not values:
-      continue
-    user_id = values[0]
-    name = values[1]
-    date_added = values[-1]
-    user = guild.get_member(user_id)
-    if not user:
-      logger.warning(f"Skipping missing user: {user_id}, {name}")
-      continue
-
-    try:
-      relative_time = discord.utils.format_dt(datetime.fromisoformat(date_added), style="R")
-    except ValueError:
-      # Catch the error here in case a date was mangled.
-      relative_time = f"`Invalid Date: {date_added}`"
-    mention_list.append(f"{user.mention} {relative_time}")
+class MentionRenderer:
+  """
+  Renders rows as lines of mentions, memoizing each line by (user_id, date).
 
-  return "\n".join(mention_list)
+  Members are still looked up on every render so users who left the server
+  are skipped.
+  """
+  max_lines = 1000
 
+  def __init__(self, guild: discord.Guild):
+    self.guild = guild
+    self.lines = {}
 
-async def requests_message_embed(sheets_wrapper, guild) -> discord.Embed:
+  def get_mentions(self, user_rows: list[Optional[Row]]) -> str:
+    mention_list = []
+    for row in user_rows:
+      # TODO: Better handle empty rows.
+      if not row:
+        continue
+      user = self.guild.get_member(row.id)
+      if not user:
+        logger.warning(f"Skipping missing user: {row.id}, {row.name}")
+        continue
+      mention_list.append(self._line(user, row.date))
+
+    return "\n".join(mention_list)
+
+  def _line(self, user: discord.Member, date_added) -> str:
+    key = (user.id, date_added)
+    if key not in self.lines:
+      # Stale lines are never read again, so just start over when it's full.
+      if len(self.lines) >= self.max_lines:
+        self.lines.clear()
+      if isinstance(date_added, datetime):
+        relative_time = discord.utils.format_dt(date_added, style="R")
+      else:
+        # The date was mangled, so it couldn't be parsed.
+        relative_time = f"`Invalid Date: {date_added}`"
+      self.lines[key] = f"{user.mention} {relative_time}"
+    return self.lines[key]
+
+
+async def requests_message_embed(sheets_wrapper, renderer: MentionRenderer) -> discord.Embed:
   embed = discord.Embed(title="**Screening Wait List**")
   embed.colour = discord.Colour.blue()
   embed.description = (
@@ -91,42 +120,81 @@ async def requests_message_embed(sheets_wrapper, guild) -> discord.Embed:
       "Check the message below to find screener readability.\n\n")
   embed.set_footer(text="Add yourself to this list with /screenme")
 
-  requesters = await asyncio.to_thread(sheets_wrapper.get_all, "Requests")
-  embed.description += get_mentions(requesters, guild)
+  requesters = await sheets_wrapper.async_.get_all("Requests")
+  embed.description += renderer.get_mentions(requesters)
   return embed
 
 
-async def callers_message_embed(sheets_wrapper, guild) -> discord.Embed:
+async def callers_message_embed(sheets_wrapper, renderer: MentionRenderer) -> discord.Embed:
   embed = discord.Embed(title="Caller Wait List")
   embed.colour = discord.Colour.green()
   embed.description = "These are people waiting to speak on the live show.\n\n"
 
-  new_callers = await asyncio.to_thread(sheets_wrapper.get_all, "New Callers")
-  repeat_callers = await asyncio.to_thread(sheets_wrapper.get_all, "Repeat Callers")
+  new_callers = await sheets_wrapper.async_.get_all("New Callers")
+  repeat_callers = await sheets_wrapper.async_.get_all("Repeat Callers")
 
-  embed.description += f"**New Callers:**\n{get_mentions(new_callers, guild)}"
-  embed.description += f"\n\n**Repeat Callers:**\n{get_mentions(repeat_callers, guild)}"
+  embed.description += f"**New Callers:**\n{renderer.get_mentions(new_callers)}"
+  embed.description += f"\n\n**Repeat Callers:**\n{renderer.get_mentions(repeat_callers)}"
   return embed
 
 
-async def update_requests_message(itx: Optional[discord.Interaction], config_wrapper: ConfigWrapper, sheets_wrapper, guild):
-  list_message = await config_wrapper.requests_message()
-  if list_message:
-    embed = await requests_message_embed(sheets_wrapper, guild)
-    await list_message.edit(embed=embed)
-  else:
-    logger.error("Unable to update requests message: not found")
-    if itx:
-      await itx.followup.send("No requests list message was found. Use `/requests send_message` to create one.")
+def embed_hash(embed: discord.Embed) -> str:
+  return hashlib.sha256(json.dumps(embed.to_dict(), sort_keys=True).encode()).hexdigest()
+
 
+class ListMessages:
+  """
+  Keeps the requests and callers list messages up to date.
 
-async def update_callers_message(itx: discord.Interaction, config_wrapper: ConfigWrapper, sheets_wrapper, guild):
-  list_message = await config_wrapper.callers_message()
-  if list_message:
-    embed = await callers_message_embed(sheets_wrapper, guild)
+  Commands call `schedule()` on the list they changed and don't wait for the
+  edit. A burst of changes results in one edit per refresh window, and the
+  edit is skipped entirely if the rendered embed hasn't changed.
+  """
+  def __init__(self, sheets_wrapper: StorageBackend, config_wrapper: ConfigWrapper, guild: discord.Guild):
+    self.sheets_wrapper = sheets_wrapper
+    self.config_wrapper = config_wrapper
+    self.renderer = MentionRenderer(guild)
+    # The hash of the last embed sent, keyed by message id.
+    self.embed_hashes = {}
+    self.requests = RefreshScheduler(self.update_requests, config_wrapper.refresh_window)
+    self.callers = RefreshScheduler(self.update_callers, config_wrapper.refresh_window)
+
+  async def requests_embed(self) -> discord.Embed:
+    return await requests_message_embed(self.sheets_wrapper, self.renderer)
+
+  async def callers_embed(self) -> discord.Embed:
+    return await callers_message_embed(self.sheets_wrapper, self.renderer)
+
+  async def update_requests(self, itx: Optional[discord.Interaction]=None):
+    await self._update(itx, "requests", self.config_wrapper.requests_message, self.requests_embed)
+
+  async def update_callers(self, itx: Optional[discord.Interaction]=None):
+    await self._update(itx, "callers", self.config_wrapper.callers_message, self.callers_embed)
+
+  async def _update(self, itx: Optional[discord.Interaction], name: str, get_message, render):
+    list_message = await get_message()
+    if list_message:
+      # Scheduled refreshes shouldn't hold up commands waiting on the quota.
+      with nullcontext() if itx else background():
+        embed = await render()
+      try:
+        await self._edit(list_message, embed)
+      except discord.NotFound:
+        # The cached handle may be stale, so check with Discord before giving up.
+        list_message = await get_message(fetch=True)
+        if list_message:
+          await self._edit(list_message, embed)
+    if not list_message:
+      logger.error(f"Unable to update {name} message: not found")
+      if itx:
+        await itx.followup.send(f"No {name} list message was found. Use `/{name} send_message` to create one.")
+
+  async def _edit(self, list_message: discord.PartialMessage, embed: discord.Embed):
+    digest = embed_hash(embed)
+    if self.embed_hashes.get(list_message.id) == digest:
+      return
     await list_message.edit(embed=embed)
-  else:
-    await itx.followup.send("No callers list message was found. Use `/callers send_message` to create one.")
+    self.embed_hashes[list_message.id] = digest
 
 
 async def add_role(itx: discord.Interaction, user: discord.Member, role: Optional[discord.Role]) -> bool:
@@ -146,10 +214,13 @@ async def remove_role(itx: discord.Interaction, user: discord.Member, role: Opti
 
 
 class UserCommandsCog(commands.Cog, description="Call-in commands for users."):
-  def __init__(self, sheets_wrapper: SheetsWrapper, config_wrapper: ConfigWrapper, guild: discord.Guild):
+  def __init__(self, sheets_wrapper: StorageBackend, config_wrapper: ConfigWrapper, guild: discord.Guild,
+      list_messages: ListMessages, request_expiry: ExpiryQueue):
     self.sheets_wrapper = sheets_wrapper
     self.config_wrapper = config_wrapper
     self.guild = guild
+    self.list_messages = list_messages
+    self.request_expiry = request_expiry
 
   async def cog_load(self):
     logger.info("UserCommandsCog loaded.")
@@ -163,35 +234,40 @@ class UserCommandsCog(commands.Cog, description="Call-in commands for users."):
       await itx.response.send_message("You must use this command in a guild channel!", ephemeral=True)
       return
     await itx.response.defer(ephemeral=True)
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    found = await self.sheets_wrapper.async_.find_user(
+        user.id, ["Requests", "New Callers", "Repeat Callers"], full_rows=["Requests"])
+    if "Requests" in found:
       await itx.followup.send("You're already on the requests list.", ephemeral=True)
       return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "New Callers", user.id):
-      await itx.followup.send("You're already on the callers list.", ephemeral=True)
-      return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Repeat Callers", user.id):
+    if found:
       await itx.followup.send("You're already on the callers list.", ephemeral=True)
       return
     values = [user.id, str(user), sheet_time()]
-    await asyncio.to_thread(self.sheets_wrapper.append, "Requests", values)
+    await self.sheets_wrapper.async_.append("Requests", values)
+    self.request_expiry.add(user.id, datetime.fromisoformat(values[-1]))
     if not await add_role(itx, user, await self.config_wrapper.requests_role()):
       return
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    self.list_messages.requests.schedule()
     await itx.followup.send("You've been added to the requests list!", ephemeral=True)
 
 
 @app_commands.guilds(GUILD_ID)
 class RequestsCog(commands.GroupCog, group_name="requests", description="Commands to manage screening requests"):
-  def __init__(self, sheets_wrapper: SheetsWrapper, config_wrapper: ConfigWrapper, guild: discord.Guild,
-      dev: Optional[discord.Member]):
+  def __init__(self, sheets_wrapper: StorageBackend, config_wrapper: ConfigWrapper, guild: discord.Guild,
+      list_messages: ListMessages, request_expiry: ExpiryQueue, dev: Optional[discord.Member]):
     self.sheets_wrapper = sheets_wrapper
     self.config_wrapper = config_wrapper
     self.guild = guild
+    self.list_messages = list_messages
+    self.request_expiry = request_expiry
     self.dev = dev
+    # Users who can't be DMed, so autoremoval doesn't keep trying them.
+    self.closed_dms: set[int] = set()
 
   async def cog_load(self):
     logger.info("RequestsCog loaded.")
     self.removal_loop.start()
+    self.expiry_loop.start()
 
   async def log(self, content: str, level=logging.INFO):
     logger.log(level, content)
@@ -208,49 +284,95 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
       await terminal.send(content)
 
   @tasks.loop(seconds=autoremoval_loop_interval)
+  @in_background
   async def removal_loop(self):
-    """A loop which removes users who haven't been confirmed by the timeout."""
-    # Get all requests.
-    requesters = await asyncio.to_thread(self.sheets_wrapper.get_all, "Requests")
+    """A loop which rebuilds the expiry queue from the sheet to catch manual edits."""
+    # Reread the sheet in case it was edited by hand.
+    marker = self.request_expiry.mark()
+    await self.sheets_wrapper.async_.invalidate("Requests")
+    requesters = await self.sheets_wrapper.async_.get_all("Requests")
 
     missing_ids = []
-    delete_users = []
-    max_days = self.config_wrapper.requests_timeout()
-    for values in requesters:
-      if not values:
+    entries = []
+    for row in requesters:
+      if not row:
         continue
-      user_id = values[0]
-      name = values[1]
-      date_added = values[-1]
-      user = self.guild.get_member(user_id)
+      user = self.guild.get_member(row.id)
 
       if not user:
-        await self.log(f"Removing missing user: `{name}` `({user_id})`.")
-        missing_ids.append(user_id)
-        continue
-
-      try:
-        dt = datetime.fromisoformat(date_added)
-      except ValueError:
-        await self.log(f"Skipping invalid datetime for `{user}`: {date_added}", level=logging.WARNING)
+        await self.log(f"Removing missing user: `{row.name}` `({row.id})`.")
+        missing_ids.append(row.id)
         continue
 
-      td = datetime.today() - dt
-      if td.days >= max_days:
-        await self.log(f"Removing `{user}` who's been on the list for more than {max_days} days.")
-        delete_users.append(user)
-
-    delete_ids = [u.id for u in delete_users] + missing_ids
-    if delete_ids:
-      await asyncio.to_thread(self.sheets_wrapper.delete, "Requests", *delete_ids)
-      await update_requests_message(None, self.config_wrapper, self.sheets_wrapper, self.guild)
-    for u in delete_users:
-      try:
-        await u.send(f"You were automatically removed from the MrGirl Hotline caller requests list because you weren't screened within {max_days} days.\n\nIf you'd still like to be screened, run `/screenme` again in the requests channel. Be sure to read the instructions to ensure you're screened next time.")
-      except Exception as error:
-        logger.info(f"Unable to DM `{u}` about their autoremoval:\n	{error}")
+      if isinstance(row.date, datetime):
+        entries.append((row.id, row.date))
+      else:
+        await self.log(f"Skipping invalid datetime for `{user}`: {row.date}", level=logging.WARNING)
+
+    # Keep adds and removals made while the sheet was being read.
+    self.request_expiry.reset(entries, since=marker)
+    if missing_ids:
+      await self.sheets_wrapper.async_.delete("Requests", *missing_ids)
+      self.list_messages.requests.schedule()
+
+  @tasks.loop()
+  @in_background
+  async def expiry_loop(self):
+    """A loop which sleeps until the next request expires, then removes everyone who is due."""
+    lifetime = timedelta(days=self.config_wrapper.requests_timeout())
+    # Cap the wait so a changed timeout is picked up.
+    await self.request_expiry.wait(lifetime, max_wait=autoremoval_loop_interval)
+    await self.remove_expired()
+
+  async def remove_expired(self):
+    """Removes users who haven't been screened by the timeout."""
+    max_days = self.config_wrapper.requests_timeout()
+    delete_ids = self.request_expiry.pop_due(datetime.today() - timedelta(days=max_days))
+    if not delete_ids:
+      return
 
+    # Users removed from the sheet by hand are no longer there to remove or notify.
+    deleted_ids = await self.sheets_wrapper.async_.delete("Requests", *delete_ids)
+    if not deleted_ids:
+      return
+    self.list_messages.requests.schedule()
 
+    delete_users = []
+    for user_id in deleted_ids:
+      user = self.guild.get_member(user_id)
+      if not user:
+        await self.log(f"Removed missing user: `({user_id})`.")
+        continue
+      await self.log(f"Removed `{user}` who's been on the list for more than {max_days} days.")
+      delete_users.append(user)
+    await self.notify_removed(delete_users, max_days)
+
+  async def notify_removed(self, users: list[discord.Member], max_days: int):
+    """DMs users about their autoremoval a few at a time, logging one summary of failures."""
+    content = f"You were automatically removed from the MrGirl Hotline caller requests list because you weren't screened within {max_days} days.\n\nIf you'd still like to be screened, run `/screenme` again in the requests channel. Be sure to read the instructions to ensure you're screened next time."
+    semaphore = asyncio.Semaphore(autoremoval_dm_concurrency)
+
+    async def send(user: discord.Member) -> Optional[str]:
+      async with semaphore:
+        # discord.py waits out 429s itself, so the semaphore only bounds concurrency.
+        try:
+          await user.send(content)
+        except discord.Forbidden:
+          self.closed_dms.add(user.id)
+          return f"`{user}`: DMs are closed"
+        except Exception as error:
+          return f"`{user}`: {error}"
+      return None
+
+    skipped = [u for u in users if u.id in self.closed_dms]
+    results = await asyncio.gather(*[send(u) for u in users if u.id not in self.closed_dms])
+    failures = [result for result in results if result]
+    if skipped:
+      failures.append(f"Skipped {len(skipped)} users with closed DMs.")
+    if failures:
+      logger.info("Unable to DM some users about their autoremoval:\n	" + "\n	".join(failures))
+
+  @expiry_loop.error
   @removal_loop.error
   async def on_removal_loop_error(self, error):
     content = f"**Requests removal loop failed.**\n\nIf the error has been resolved, you can start the loop again using `/requests start_loop`.\n```py{''.join(traceback.format_exception(error))}```"
@@ -261,7 +383,7 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
     """Sends the call list message. Only needed on first setup."""
     # TODO: Handle existing message.
     await itx.response.defer()
-    embed = await requests_message_embed(self.sheets_wrapper, self.guild)
+    embed = await self.list_messages.requests_embed()
     message = await channel.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
 
     # Store this new message in the config.
@@ -275,34 +397,39 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
   async def refresh(self, itx:discord.Interaction):
     """Refreshes the requests list message. (Only needed for manual edits)."""
     await itx.response.defer()
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    await self.sheets_wrapper.async_.invalidate("Requests")
+    await self.list_messages.update_requests(itx)
     await itx.followup.send("Refreshed the message!")
 
   @app_commands.command()
   async def add(self, itx: discord.Interaction, user: discord.Member):
     """Adds a user to the requests list."""
     await itx.response.defer()
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    found = await self.sheets_wrapper.async_.find_user(
+        user.id, ["Requests", "New Callers", "Repeat Callers"], full_rows=["Requests"])
+    if "Requests" in found:
       await itx.followup.send(f"`{user}` is already on the requests list..")
       return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "New Callers", user.id):
+    if "New Callers" in found:
       await itx.followup.send(f"`{user}` is already on the new callers list.")
       return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Repeat Callers", user.id):
+    if "Repeat Callers" in found:
       await itx.followup.send(f"`{user}` is already on the repeat callers list.")
       return
     values = [user.id, str(user), sheet_time()]
-    await asyncio.to_thread(self.sheets_wrapper.append, "Requests", values)
+    await self.sheets_wrapper.async_.append("Requests", values)
+    self.request_expiry.add(user.id, datetime.fromisoformat(values[-1]))
     if not await add_role(itx, user, await self.config_wrapper.requests_role()):
       return
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    self.list_messages.requests.schedule()
     await itx.followup.send(f"Added {user} to the requests list!")
 
   @app_commands.command()
   async def approve(self, itx: discord.Interaction, user: discord.Member, european: bool=False):
     """Approves a user after screening, moving them to the callers lists."""
     await itx.response.defer()
-    if not await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    found = await self.sheets_wrapper.async_.find_user(user.id, ["Requests", "Caller History"], full_rows=["Requests"])
+    if "Requests" not in found:
       view = ConfirmationView()
       await itx.followup.send(f"`{user}` isn't on the requests list, approve them anyway?", view=view)
       await view.wait()
@@ -310,30 +437,29 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
         return
 
     values = [user.id, str(user), european, sheet_time()]
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Caller History", user.id):
-      await asyncio.to_thread(self.sheets_wrapper.append, "Repeat Callers", values)
-    else:
-      await asyncio.to_thread(self.sheets_wrapper.append, "New Callers", values)
-    await asyncio.to_thread(self.sheets_wrapper.delete, "Requests", user.id)
+    callers_sheet = "Repeat Callers" if "Caller History" in found else "New Callers"
+    await self.sheets_wrapper.async_.move(user.id, ["Requests"], callers_sheet, values)
+    self.request_expiry.discard(user.id)
     if not await remove_role(itx, user, await self.config_wrapper.requests_role()):
       return
     if not await add_role(itx, user, await self.config_wrapper.callers_role()):
       return
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
-    await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    self.list_messages.requests.schedule()
+    self.list_messages.callers.schedule()
     await itx.followup.send(f"{user} has been approved!")
 
   @app_commands.command()
   async def deny(self, itx: discord.Interaction, user: discord.Member, reason: str):
     """Denies a user after screening, recording the reason they were rejected."""
     await itx.response.defer()
-    if not await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    if not await self.sheets_wrapper.async_.get("Requests", user.id):
       await itx.followup.send(f"`{user}` isn't on the requests list.")
       return
     values = [user.id, str(user), reason, sheet_time()]
-    await asyncio.to_thread(self.sheets_wrapper.append, "Denied Requests", values)
-    await asyncio.to_thread(self.sheets_wrapper.delete, "Requests", user.id)
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    await self.sheets_wrapper.async_.append("Denied Requests", values)
+    await self.sheets_wrapper.async_.delete("Requests", user.id)
+    self.request_expiry.discard(user.id)
+    self.list_messages.requests.schedule()
     if not await remove_role(itx, user, await self.config_wrapper.requests_role()):
       return
     await itx.followup.send(f"`{user}` was denied: {reason}")
@@ -342,11 +468,12 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
   async def remove(self, itx: discord.Interaction, user: discord.Member):
     """Removes a user from the requests list."""
     await itx.response.defer()
-    if not await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    if not await self.sheets_wrapper.async_.get("Requests", user.id):
       await itx.followup.send(f"`{user}` isn't on the requests list.")
       return
-    await asyncio.to_thread(self.sheets_wrapper.delete, "Requests", user.id)
-    await update_requests_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    await self.sheets_wrapper.async_.delete("Requests", user.id)
+    self.request_expiry.discard(user.id)
+    self.list_messages.requests.schedule()
     if not await remove_role(itx, user, await self.config_wrapper.requests_role()):
       return
     await itx.followup.send(f"`{user}` was removed from requests.")
@@ -354,19 +481,22 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
   @app_commands.command()
   async def start_loop(self, itx: discord.Interaction):
     """Starts the requests autoremoval loop. The loop is already started when the bot starts."""
-    if self.removal_loop.is_running():
+    if self.removal_loop.is_running() and self.expiry_loop.is_running():
       await itx.response.send_message("The autoremoval loop is already running.")
       return
-    self.removal_loop.start()
+    for loop in (self.removal_loop, self.expiry_loop):
+      if not loop.is_running():
+        loop.start()
     await itx.response.send_message("Started the autoremoval loop.")
 
   @app_commands.command()
   async def stop_loop(self, itx: discord.Interaction):
     """Stops the requests autoremoval loop."""
-    if not self.removal_loop.is_running():
+    if not (self.removal_loop.is_running() or self.expiry_loop.is_running()):
       await itx.response.send_message("The autoremoval loop is stopped.")
       return
     self.removal_loop.cancel()
+    self.expiry_loop.cancel()
     await itx.response.send_message("Stopped the autoremoval loop.")
 
 
@@ -374,10 +504,12 @@ class RequestsCog(commands.GroupCog, group_name="requests", description="Command
 @app_commands.guilds(GUILD_ID)
 class CallersCog(commands.GroupCog, group_name="callers", description="Commands to manage callers."):
   """A set of commands related to screened callers."""
-  def __init__(self, sheets_wrapper: SheetsWrapper, config_wrapper: ConfigWrapper, guild: discord.Guild):
+  def __init__(self, sheets_wrapper: StorageBackend, config_wrapper: ConfigWrapper, guild: discord.Guild,
+      list_messages: ListMessages):
     self.sheets_wrapper = sheets_wrapper
     self.config_wrapper = config_wrapper
     self.guild = guild
+    self.list_messages = list_messages
 
   async def cog_load(self):
     logger.info("CallersCog loaded.")
@@ -387,7 +519,7 @@ class CallersCog(commands.GroupCog, group_name="callers", description="Commands
     """Sends the call list message. Only needed on first setup."""
     # TODO: Handle existing message.
     await itx.response.defer()
-    embed = await callers_message_embed(self.sheets_wrapper, self.guild)
+    embed = await self.list_messages.callers_embed()
     message = await channel.send(embed=embed, allowed_mentions=discord.AllowedMentions.none())
 
     # Store this new message in the config.
@@ -401,7 +533,8 @@ class CallersCog(commands.GroupCog, group_name="callers", description="Commands
   async def refresh(self, itx:discord.Interaction):
     """Refreshes the caller list message. (Only needed for manual edits)."""
     await itx.response.defer()
-    await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    await self.sheets_wrapper.async_.invalidate("New Callers", "Repeat Callers", "Caller History")
+    await self.list_messages.update_callers(itx)
     await itx.followup.send("Refreshed the message!")
 
   @app_commands.command()
@@ -409,41 +542,46 @@ class CallersCog(commands.GroupCog, group_name="callers", description="Commands
     """Adds a user to the callers list, bypassing the screening process."""
     await itx.response.defer()
     # Sanity check the lists.
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Requests", user.id):
+    found = await self.sheets_wrapper.async_.find_user(
+        user.id, ["Requests", "New Callers", "Repeat Callers", "Caller History"],
+        full_rows=["New Callers", "Repeat Callers"])
+    if "Requests" in found:
       await itx.followup.send(f"`{user}` is already on the requests list. Use /requests approve.")
       return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "New Callers", user.id):
+    if "New Callers" in found:
       await itx.followup.send(f"`{user}` is already on the new callers list.")
       return
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Repeat Callers", user.id):
+    if "Repeat Callers" in found:
       await itx.followup.send(f"`{user}` is already on the repeat callers list.")
       return
 
     # Add the user to the appropriate call list.
     values = [user.id, str(user), european, sheet_time()]
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Caller History", user.id):
-      await asyncio.to_thread(self.sheets_wrapper.append, "Repeat Callers", values)
+    if "Caller History" in found:
+      await self.sheets_wrapper.async_.append("Repeat Callers", values)
       await itx.followup.send(f"Added {user} to the new callers list!")
     else:
-      await asyncio.to_thread(self.sheets_wrapper.append, "New Callers", values)
+      await self.sheets_wrapper.async_.append("New Callers", values)
       await itx.followup.send(f"Added {user} to the new callers list!")
     if not await add_role(itx, user, await self.config_wrapper.callers_role()):
       return
-    await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    self.list_messages.callers.schedule()
 
   @app_commands.command()
   async def remove(self, itx: discord.Interaction, user: discord.Member):
     """Removes a user from the callers list."""
     await itx.response.defer()
-    if await asyncio.to_thread(self.sheets_wrapper.get, "New Callers", user.id):
-      await asyncio.to_thread(self.sheets_wrapper.delete, "New Callers", user.id)
-      await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    found = await self.sheets_wrapper.async_.find_user(
+        user.id, ["New Callers", "Repeat Callers"], full_rows=["New Callers", "Repeat Callers"])
+    if "New Callers" in found:
+      await self.sheets_wrapper.async_.delete("New Callers", user.id)
+      self.list_messages.callers.schedule()
       if not await remove_role(itx, user, await self.config_wrapper.callers_role()):
         return
       await itx.followup.send(f"Removed {user} from the new callers list.")
-    elif await asyncio.to_thread(self.sheets_wrapper.get, "Repeat Callers", user.id):
-      await asyncio.to_thread(self.sheets_wrapper.delete, "Repeat Callers", user.id)
-      await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    elif "Repeat Callers" in found:
+      await self.sheets_wrapper.async_.delete("Repeat Callers", user.id)
+      self.list_messages.callers.schedule()
       if not await remove_role(itx, user, await self.config_wrapper.callers_role()):
         return
       await itx.followup.send(f"Removed {user} from the repeat callers list.")
@@ -467,10 +605,8 @@ class CallersCog(commands.GroupCog, group_name="callers", description="Commands
     await view.wait()
     if view.said_yes:
       values = [user.id, str(user), sheet_time()]
-      await asyncio.to_thread(self.sheets_wrapper.append, "Caller History", values)
-      await asyncio.to_thread(self.sheets_wrapper.delete, "New Callers", user.id)
-      await asyncio.to_thread(self.sheets_wrapper.delete, "Repeat Callers", user.id)
-      await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+      await self.sheets_wrapper.async_.move(user.id, ["New Callers", "Repeat Callers"], "Caller History", values)
+      self.list_messages.callers.schedule()
       if not await remove_role(itx, user, await self.config_wrapper.callers_role()):
         return
     else:
@@ -483,11 +619,11 @@ class CallersCog(commands.GroupCog, group_name="callers", description="Commands
     """Adds a user to the past callers history list."""
     await itx.response.defer()
     # Sanity check the lists.
-    if await asyncio.to_thread(self.sheets_wrapper.get, "Caller History", user.id):
+    if await self.sheets_wrapper.async_.find_user(user.id, ["Caller History"]):
       await itx.followup.send(f"`{user}` is already in the caller history.")
       return
 
     values = [user.id, str(user), sheet_time()]
-    await asyncio.to_thread(self.sheets_wrapper.append, "Caller History", values)
-    await update_callers_message(itx, self.config_wrapper, self.sheets_wrapper, self.guild)
+    await self.sheets_wrapper.async_.append("Caller History", values)
+    self.list_messages.callers.schedule()
     await itx.followup.send(f"Added {user} to the caller history.")
@@ -0,0 +1,55 @@
+import logging
+
+
+from discord.ext import commands, tasks
+from quota import in_background
+from sheets_orm import StorageBackend
+from user_commands import ListMessages
+
+
+logger = logging.getLogger(__name__)
+watch_interval = 30 # Seconds.
+
+
+class SheetWatcherCog(commands.Cog):
+  """
+  A cog which watches the list sheets for manual edits.
+
+  Only the id column of each watched sheet is read, in a single request
+  which also picks up rows added to the append-only sheets, and a sheet is
+  only reread in full when its ids changed. A list message is
+  only re-rendered when one of its sheets actually changed. After each
+  check, the backend's snapshot is saved, so the first check after startup
+  also reconciles any sheets loaded from the snapshot.
+  """
+  def __init__(self, sheets_wrapper: StorageBackend, list_messages: ListMessages):
+    self.sheets_wrapper = sheets_wrapper
+    self.list_messages = list_messages
+
+  async def cog_load(self):
+    logger.info("SheetWatcherCog loaded.")
+    self.watch_loop.start()
+
+  async def cog_unload(self):
+    self.watch_loop.cancel()
+
+  @tasks.loop(seconds=watch_interval)
+  @in_background
+  async def watch_loop(self):
+    try:
+      changed = await self.sheets_wrapper.async_.poll_changes(["Requests", "New Callers", "Repeat Callers"])
+    except Exception as error:
+      # Keep watching through transient Sheets errors.
+      logger.warning("Unable to check the sheets for edits.", exc_info=error)
+      return
+    if changed:
+      logger.info(f"Detected manual edits to {', '.join(changed)}.")
+    if "Requests" in changed:
+      self.list_messages.requests.schedule()
+    if "New Callers" in changed or "Repeat Callers" in changed:
+      self.list_messages.callers.schedule()
+    try:
+      await self.sheets_wrapper.async_.save_snapshot()
+    except Exception as error:
+      logger.warning("Unable to save the snapshot.", exc_info=error)
+
@@ -0,0 +1,125 @@
+"""A module for queueing writes locally and sending them to Google Sheets later.
+
+Usage:
+  journal = WriteJournal("journal.db")
+  journal.push("append", "Requests", None, [user_id, name, date])
+  flusher = FlushThread(flush)
+  flusher.start()
+  flusher.wake()
+
+  Writes are committed to SQLite before push() returns, so anything that
+  wasn't flushed before a restart is still there to be replayed. Writes
+  which can never succeed, e.g. to a sheet which was deleted, are moved to
+  a dead_letters table with bury() so they don't hold up the rest.
+"""
+
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+from googleapiclient.errors import HttpError
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def retryable(error: Exception) -> bool:
+  """Returns whether a failed write might succeed later, e.g. after a network error, 429 or 5xx."""
+  if isinstance(error, HttpError):
+    return error.resp.status == 429 or error.resp.status >= 500
+  # Bad data, e.g. a sheet which no longer exists, fails the same way every time.
+  return not isinstance(error, (KeyError, ValueError, TypeError))
+
+
+class WriteJournal:
+  """
+  A durable, ordered queue of sheet writes.
+
+  Pass an open connection as `db` to keep the queue in an existing database,
+  so writes can be queued in the same transaction as other changes with
+  queue(). Transactions on that connection should hold `lock`.
+  """
+  def __init__(self, path: Optional[str]=None, db: Optional[sqlite3.Connection]=None):
+    self.lock = threading.RLock()
+    self.db = db or sqlite3.connect(path, check_same_thread=False)
+    with self.db:
+      self.db.execute(
+          "CREATE TABLE IF NOT EXISTS writes ("
+          "id INTEGER PRIMARY KEY, op TEXT NOT NULL, sheet TEXT NOT NULL, row_number INTEGER, "
+          "data TEXT NOT NULL)")
+      self.db.execute(
+          "CREATE TABLE IF NOT EXISTS dead_letters ("
+          "id INTEGER PRIMARY KEY, op TEXT NOT NULL, sheet TEXT NOT NULL, row_number INTEGER, "
+          "data TEXT NOT NULL, error TEXT NOT NULL)")
+
+  def __len__(self):
+    with self.lock:
+      return self.db.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+
+  def push(self, op: str, sheet: str, row_number: Optional[int], values: list):
+    with self.lock, self.db:
+      self.queue(op, sheet, row_number, values)
+
+  def queue(self, op: str, sheet: str, row_number: Optional[int], values: list):
+    """Adds a write without committing, for a caller holding `lock` in a transaction of its own."""
+    self.db.execute(
+        "INSERT INTO writes (op, sheet, row_number, data) VALUES (?, ?, ?, ?)",
+        (op, sheet, row_number, json.dumps(values)))
+
+  def pending(self) -> list[tuple[int, str, str, Optional[int], list]]:
+    """Returns (id, op, sheet, row_number, values) for every queued write, oldest first."""
+    with self.lock:
+      cursor = self.db.execute("SELECT id, op, sheet, row_number, data FROM writes ORDER BY id")
+      return [(id, op, sheet, row_number, json.loads(data)) for id, op, sheet, row_number, data in cursor]
+
+  def remove(self, ids: list[int]):
+    with self.lock, self.db:
+      self.db.executemany("DELETE FROM writes WHERE id = ?", [(id,) for id in ids])
+
+  def bury(self, ids: list[int], error: Exception):
+    """Moves writes which can never succeed out of the queue and into dead_letters."""
+    with self.lock, self.db:
+      self.db.executemany(
+          "INSERT INTO dead_letters (op, sheet, row_number, data, error) "
+          "SELECT op, sheet, row_number, data, ? FROM writes WHERE id = ?",
+          [(repr(error), id) for id in ids])
+      self.db.executemany("DELETE FROM writes WHERE id = ?", [(id,) for id in ids])
+
+
+class FlushThread(threading.Thread):
+  """
+  A thread which calls flush() shortly after each wake().
+
+  Waiting `delay` seconds lets a burst of writes go out as one batch. Failed
+  flushes are retried with exponential backoff.
+  """
+  def __init__(self, flush: Callable[[], None], delay: float=1.0, max_backoff: float=60.0):
+    super().__init__(name="write-behind", daemon=True)
+    self.flush = flush
+    self.delay = delay
+    self.max_backoff = max_backoff
+    self.event = threading.Event()
+
+  def wake(self):
+    self.event.set()
+
+  def run(self):
+    backoff = self.delay
+    while True:
+      self.event.wait()
+      time.sleep(self.delay)
+      # Clear before flushing so writes made during the flush wake us again.
+      self.event.clear()
+      try:
+        self.flush()
+        backoff = self.delay
+      except Exception as error:
+        logger.warning(f"Unable to flush writes to Google Sheets, retrying in {backoff}s.", exc_info=error)
+        time.sleep(backoff)
+        backoff = min(backoff * 2, self.max_backoff)
+        self.event.set()